@@ -10,10 +10,32 @@ class CLIObject:
                                     # not sure why, but must be something to do with incompatibility with the click package
                                     # since removing 'import click' statement above fixes it too
         self.test = test
-        setup_settings(synctree)
+        self.settings = setup_settings(synctree)
+        self.tree = None
 
     def init_synctreetest(self, template, readfromdisk, writetodisk):
-        pass
+        """
+        Builds and imports self.tree as set up in the [SYNCTREE] section of settings.ini:
+        branches and subbranches (space separated), model_klass_list and importer_klass_list (patterns)
+        With cache_path set there, imports are cached: --read reuses subbranches whose sources
+        have not changed, --write stores the imported tree for next time
+        """
+        if not self.settings.has_section('SYNCTREE'):
+            return
+        from synctree import SyncTree
+        from synctree.cache import ImportCache
+        section = self.settings['SYNCTREE']
+        self.tree = SyncTree(
+            section['branches'].split(),
+            section['subbranches'].split(),
+            model_klass_list=section.get('model_klass_list'),
+            importer_klass_list=section.get('importer_klass_list'),
+        )
+        cache_path = section.get('cache_path')
+        if cache_path and (readfromdisk or writetodisk):
+            ImportCache(self.tree, cache_path, read=readfromdisk, write=writetodisk).import_tree()
+        else:
+            +self.tree
 
     def init_pspfsyncer(self):
         self.source = self.autosend_tree
@@ -4,8 +4,8 @@ import click
 @click.group()
 @click.option('--test/--dont_test', default=False, help="Uses test information")
 @click.option('--template', type=click.STRING, default=None, help="Define the template")
-@click.option('--read/--dontread', is_flag=True, default=False, help="Readin pickled data")
-@click.option('--write/--dontwrite', is_flag=True, default=True, help="Write pickled data")
+@click.option('--read/--dontread', is_flag=True, default=False, help="Reuse cached imports whose sources are unchanged")
+@click.option('--write/--dontwrite', is_flag=True, default=True, help="Cache imported data")
 @click.pass_context
 def synctree_entry(ctx, test, template, read, write):
     """ entry point """
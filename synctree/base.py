@@ -1,6 +1,12 @@
 from synctree.actions import define_action
 import ast
-import copy
+import copyreg
+import datetime
+import decimal
+import hashlib
+import inspect
+import types
+from operator import attrgetter
 from synctree.utils import SetEncoder
 import json
 
@@ -10,32 +16,287 @@ class initobj:
     Used when creating objects when not using Base class
     Objects inherit from Basebase
 
+    The class is made once, on the first call, with __slots__ taken from that first
+    row's keys; rows carrying other keys fall back to the instance __dict__
+
     Usage:
     klass = initobj('branch', 'subbranch')
     instance = klass()
     """
     def __init__(self, branch, subbranch, **kwargs):
         self._klass_name = f'{branch.title()}{subbranch.title()}'
+        self._klass = None
+
+    def klass(self, **kwargs):
+        if self._klass is None:
+            slots = [k for k in kwargs if k.isidentifier() and not hasattr(Basebase, k)]
+            slots = tuple(dict.fromkeys(['idnumber', *slots, '__dict__']))
+            self._klass = generated_klass(self._klass_name, slots)
+        return self._klass
 
     def __call__(self, idnumber, **kwargs):
-        obj_klass = type(self._klass_name, (Basebase,) , {})
-        return obj_klass(idnumber, **kwargs)
+        return self.klass(**kwargs)(idnumber, **kwargs)
+
+
+_generated_klasses = {}
+
+
+def generated_klass(name, slots):
+    """
+    The class initobj makes for name and slots, made once per process
+    Lets pickled instances find (or remake) their class in another process
+    """
+    layout = (name, tuple(slots))
+    klass = _generated_klasses.get(layout)
+    if klass is None:
+        klass = _generated_klasses[layout] = type(name, (Basebase,), {
+            '__slots__': layout[1],
+            '_sparse_slots': True,
+            '_layout': layout,
+        })
+    return klass
+
+
+def generated_instance(name, slots):
+    """ Unpickling counterpart of Basebase.__reduce_ex__ """
+    klass = generated_klass(name, slots)
+    return klass.__new__(klass)
+
+
+_slot_descriptors = {}
+
+
+def slot_descriptors(klass):
+    """
+    (name, descriptor) of every slot that holds a value on instances of klass, the cached fingerprint aside
+    """
+    descriptors = _slot_descriptors.get(klass)
+    if descriptors is None:
+        descriptors = []
+        for base in klass.__mro__:
+            declared = base.__dict__.get('__slots__', ())
+            for name in [declared] if isinstance(declared, str) else declared:
+                if name in ('__dict__', '__weakref__', '_fingerprint'):
+                    continue
+                # Private names are mangled
+                attribute = f'_{base.__name__.lstrip("_")}{name}' if name.startswith('__') and not name.endswith('__') else name
+                descriptors.append((name, base.__dict__[attribute]))
+        _slot_descriptors[klass] = descriptors
+    return descriptors
+
+
+_class_attributes = {}
+_diff_plans = {}
+
+
+def class_attributes(klass):
+    """
+    Names of the non-callable, non-underscore class attributes (slots, properties ...)
+    that Basebase.__sub__ compares on every instance of klass, in dir() order
+    """
+    attributes = _class_attributes.get(klass)
+    if attributes is None:
+        attributes = []
+        for attribute in dir(klass):
+            if attribute != attribute.lstrip('_'):
+                continue
+            static = inspect.getattr_static(klass, attribute)
+            if isinstance(static, (classmethod, staticmethod)) or callable(static):
+                continue
+            attributes.append(attribute)
+        _class_attributes[klass] = attributes
+    return attributes
+
+
+_instance_names = {}
+
+
+def instance_attributes(obj):
+    """
+    Names held in the instance __dict__ that Basebase.__sub__ also compares
+    Worked out once per class and set of keys, only whether a value is callable is checked per object
+    """
+    values = getattr(obj, '__dict__', None)
+    if not values:
+        return []
+    klass = type(obj)
+    key = (klass, tuple(values))
+    names = _instance_names.get(key)
+    if names is None:
+        names = _instance_names[key] = [a for a in values if a == a.lstrip('_') and not hasattr(klass, a)]
+    return [a for a in names if not callable(values[a])]
+
+
+def _attribute_plan(attribute, left, right):
+    """ (attribute, getter, update, add and remove method names) for one attribute """
+    subbranch, branch = getattr(left, '__subbranch__', None), getattr(right, '__branch__', None)
+    return (
+        attribute,
+        attrgetter(attribute),
+        "update_{}_{}".format(getattr(right, '__subbranch__', None), attribute),
+        "add_{}_{}_to_{}".format(subbranch, attribute, branch),
+        "remove_{}_{}_from_{}".format(subbranch, attribute, branch),
+    )
+
+
+def diff_plan(left, right):
+    """
+    The attributes Basebase.__sub__ compares, in dir() order
+    Worked out once per pair of classes (and where they sit in the tree) and names held in the instance __dict__
+    Whether a value is a list, set or scalar is still checked per value, as it can vary between records
+    """
+    key = (type(left), type(right), getattr(left, '__subbranch__', None),
+           getattr(right, '__branch__', None), getattr(right, '__subbranch__', None))
+    extra = tuple(instance_attributes(left))
+    plan = _diff_plans.get((key, extra))
+    if plan is None:
+        plan = _diff_plans.get((key, ()))
+        if plan is None:
+            plan = _diff_plans[(key, ())] = [_attribute_plan(a, left, right) for a in class_attributes(type(left))]
+        if extra:
+            plan = _diff_plans[(key, extra)] = sorted(plan + [_attribute_plan(a, left, right) for a in extra])
+    return plan
+
+
+_computing = {}
+
+# Types whose repr tells equal values from unequal ones
+_digestible = (str, int, float, bool, type(None), bytes, datetime.date, datetime.time, decimal.Decimal)
+
+
+def computes_attributes(klass):
+    """
+    Whether any attribute Basebase.__sub__ compares on klass is computed (a property or other descriptor)
+    rather than stored; computed values can depend on anything, so such objects get no fingerprint
+    """
+    computing = _computing.get(klass)
+    if computing is None:
+        computing = False
+        for attribute in class_attributes(klass):
+            static = inspect.getattr_static(klass, attribute)
+            if hasattr(type(static), '__get__') and not isinstance(static, types.MemberDescriptorType):
+                computing = True
+                break
+        _computing[klass] = computing
+    return computing
+
+
+def fingerprint(obj):
+    """
+    Digest of the stored values Basebase.__sub__ compares on obj
+    Two objects with equal fingerprints produce no actions when diffed
+    Lists and sets are compared as sets there, so their members are digested in sorted order
+    Returns None when no fingerprint can be made: a computed attribute (see computes_attributes),
+    a missing attribute, or a value of a type not in _digestible
+    """
+    if computes_attributes(type(obj)):
+        return None
+    values = []
+    for attribute in sorted(class_attributes(type(obj)) + instance_attributes(obj)):
+        try:
+            value = getattr(obj, attribute)
+        except AttributeError:
+            if obj._sparse_slots:
+                continue
+            return None
+        kind = type(value)
+        if isinstance(value, (list, set)):
+            if not all(isinstance(member, _digestible) for member in value):
+                return None
+            value = sorted({repr(member) for member in value})
+        elif not isinstance(value, _digestible):
+            return None
+        values.append((attribute, kind.__qualname__, value))
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).digest()
+
+
+_key_layouts = {}
+
+
+def key_layout(keys):
+    """ The one tuple of these keys that all objects made with them share """
+    keys = tuple(keys)
+    return _key_layouts.setdefault(keys, keys)
 
 
 class Basebase:
-    __slots__ = ['__branch__', '__subbranch__', '_node_identifier']
+    __slots__ = ['__branch__', '__subbranch__', '_node_identifier', '_fingerprint', '_keys']
+    _sparse_slots = False  # generated classes: records need not fill every slot
+    _layout = None  # generated classes: (name, slots), how they are found again when unpickled
+    _changes = 0  # counts attributes set on any object after it is made, see SyncTree.version
 
     def __init__(self, idnumber, **kwargs):
-        self.idnumber = idnumber
-        self._kwargs = kwargs
+        # There is no fingerprint to drop yet, so skip __setattr__ unless a subclass has its own
+        set_attribute = object.__setattr__ if type(self).__setattr__ is Basebase.__setattr__ else setattr
+        set_attribute(self, 'idnumber', idnumber)
+        # Values are held only in the attributes, _keys remembers which ones were passed in
+        set_attribute(self, '_keys', key_layout(kwargs))
         for key in kwargs:
-            setattr(self, key, kwargs[key])
+            set_attribute(self, key, kwargs[key])
         self.post_init()
 
+    @property
+    def _kwargs(self):
+        """
+        The keyword arguments the object was made with, as they stand now, read from its attributes
+        """
+        return {key: getattr(self, key) for key in self._keys}
+
+    def _update(self, **kwargs):
+        """
+        Set attributes after the object is made, keeping them part of _kwargs
+        """
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+        new_keys = [key for key in kwargs if key not in self._keys]
+        if new_keys:
+            self._keys = key_layout(self._keys + tuple(new_keys))
+
     def post_init(self):
         """ override me as necessary """
         pass
 
+    def __reduce_ex__(self, protocol):
+        """
+        Pickles the stored values only, slots read through their descriptors (a subclass may shadow
+        a slot with a property) and without the cached fingerprint
+        Generated classes cannot be pickled by reference, so point to their layout instead
+        """
+        slots = []
+        for index, (name, slot) in enumerate(slot_descriptors(type(self))):
+            try:
+                slots.append((index, slot.__get__(self)))
+            except AttributeError:
+                pass
+        state = (getattr(self, '__dict__', None) or None, slots)
+        if self._layout is None:
+            return (copyreg.__newobj__, (type(self), ), state)
+        return (generated_instance, self._layout, state)
+
+    def __setstate__(self, state):
+        values, slots = state
+        descriptors = slot_descriptors(type(self))
+        for index, value in slots:
+            descriptors[index][1].__set__(self, value)
+        if values:
+            vars(self).update(values)
+
+    def __setattr__(self, name, value):
+        """
+        Setting an attribute drops the cached fingerprint
+        (changing a list or set in place does not, use _update with a new one)
+        """
+        object.__setattr__(self, name, value)
+        if name[0] != '_':
+            object.__setattr__(self, '_fingerprint', None)
+            Basebase._changes += 1
+
+    def _stamp_fingerprint(self):
+        """
+        Cache the fingerprint, called once the object is imported
+        """
+        self._fingerprint = fingerprint(self)
+
     def _kvargs(self):
         try:
             return sorted({k:getattr(self, k) for k in dir(self) if not k.startswith('_')}.items(), key=lambda o: o[0])
@@ -51,7 +312,7 @@ class Basebase:
         """ 
         Returns a string
         """
-        kwargs = copy.copy(self._kwargs)
+        kwargs = self._kwargs
         kwargs['idnumber'] = self.idnumber
         return json.dumps(kwargs, cls=SetEncoder)
 
@@ -63,22 +324,25 @@ class Basebase:
         # Limitation: We don't process (yet?) for exact equivalencies across both objects
         #             So you could have something defined as 'x' as a callable on this side
         #             but as a callable on other side, and you won't pick up any changes.
-        if self._kvargs == other._kvargs:
-            # This will be picked up in the key comparisons, so skip it
+        this_fingerprint = getattr(self, '_fingerprint', None)
+        if this_fingerprint is not None and this_fingerprint == getattr(other, '_fingerprint', None):
+            # Nothing has changed, skip it
             return
 
         common = dict(idnumber=self.idnumber, obj=self, source=self, dest=other)
 
-        attributes = [a for a in dir(self) if a == a.lstrip('_') and not callable(getattr(self, a))]
-        for attribute in attributes:
+        for attribute, getter, update_method, add_method, remove_method in diff_plan(self, other):
             common.update(dict(attribute=attribute))
             try:
-                this_attr = getattr(self, attribute)
+                this_attr = getter(self)
             except AttributeError:
+                if self._sparse_slots:
+                    # Not a key of this record, so nothing to compare
+                    continue
                 yield define_action(method=f"err_no_attr:{self.__class__.__name__}.{attribute}", **common)
                 continue
             try:
-                that_attr = getattr(other, attribute)
+                that_attr = getter(other)
             except AttributeError:
                 yield define_action(method=f"err_no_attr:{other.__class__.__name__}.{attribute}", **common)
                 continue
@@ -89,19 +353,18 @@ class Basebase:
 
             if isinstance(this_attr, list):  # both are lists
                 for to_add in set(this_attr) - set(that_attr):
-                    yield define_action(value=to_add, method="add_{}_{}_to_{}".format(self.__subbranch__, attribute, other.__branch__), **common)
+                    yield define_action(value=to_add, method=add_method, **common)
                 for to_remove in set(that_attr) - set(this_attr):
-                    yield define_action(value=to_remove, method="remove_{}_{}_from_{}".format(self.__subbranch__, attribute, other.__branch__), **common)
+                    yield define_action(value=to_remove, method=remove_method, **common)
 
             elif isinstance(this_attr, set):  # both are sets
                 for to_add in this_attr - that_attr:
-                    yield define_action(value=to_add, method="add_{}_{}_to_{}".format(self.__subbranch__, attribute, other.__branch__), **common)
+                    yield define_action(value=to_add, method=add_method, **common)
                 for to_remove in that_attr - this_attr:
-                    yield define_action(value=to_remove, method="remove_{}_{}_from_{}".format(self.__subbranch__, attribute, other.__branch__), **common)
+                    yield define_action(value=to_remove, method=remove_method, **common)
 
             elif this_attr != that_attr:
-                yield define_action(method="update_{}_{}".format(other.__subbranch__, attribute), value=this_attr, old_value=that_attr, **common)
-
+                yield define_action(method=update_method, value=this_attr, old_value=that_attr, **common)
 
     def __repr__(self):
         return f"<{self.__class__.__name__}({self.idnumber})>"
@@ -112,7 +375,7 @@ class Base(Basebase):
     Prepares idnumber
     Reminder: All non-__ functions end up as properties
     """
-    __slots__ = ['idnumber', '_kwargs']
+    __slots__ = ['idnumber']
 
     def __repr__(self):
         return "<{0.__class__.__name__}({0.idnumber})>".format(self)
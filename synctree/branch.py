@@ -1,17 +1,31 @@
-from synctree.subbranch import SubBranch, SubBranchOff, SubBranchNarrow
+from synctree.subbranch import SubBranch, SubBranchOff, SubBranchNarrow, SubBranchColumnar, import_concurrently, import_asynchronously
 from synctree.actions import define_action
 
 from synctree import Wheel
 from functools import partial
 
 import ast
+import os
 import weakref
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 class NoImporter:
     pass
 
 
+def diff_pairs(pairs):
+    """
+    Runs in a worker process: diffs (left, right) object pairs
+    Returns plain tuples so that only the values cross back, not the objects
+    """
+    return [
+        (action.idnumber, action.method, action.attribute, action.value, action.old_value)
+        for left, right in pairs for action in left - right
+    ]
+
+
 class Branch:
     _subbranch_class = SubBranch
 
@@ -27,6 +41,8 @@ class Branch:
                 subbranch, command = subbranch.split(':')
                 if command.lower() == 'off':
                     subbranch_class = SubBranchOff
+                elif command.lower() == 'columnar':
+                    subbranch_class = SubBranchColumnar
                 elif command:
                     command_dict = eval(command)
                     to_narrow = command_dict[self.branchname]
@@ -44,7 +60,7 @@ class Branch:
 
     @property
     def idnumbers(self):
-        return {n.tag for n in self.subtree.all_nodes() if n.tag not in [*self.subbranches, self.branchname]}
+        return set().union(*(self.tree.idnumbers(self.branchname, sb) for sb in self.subbranches))
 
     def get_from_subbranches(self, idnumber, subbranches: ['second_branch', 'first_branch']):
         """
@@ -61,20 +77,17 @@ class Branch:
         """
         Output info and differences between objects
         """
-        contains_key = self.tree.keypath('', idnumber)
         ret = []
         output_strs = []
-        for node_key in self.tree._nodes.keys():
-            node = self.tree.get_node(node_key)
+        for branchname, _, obj in self.tree.locate(idnumber):
             # filter out stuff from other branches which is present here
-            # we shouldn't need to check that node is non None
-            if node.data and node_key.startswith(self.branchname) and node_key.split('/')[-1] == idnumber:
+            if obj and branchname == self.branchname:
                 # If returns None, it means it doesn't need to be output
-                if node.data._description is not None:
+                if obj._description is not None:
                     output_strs.append(
-                        node.data._description or repr(node.data)
+                        obj._description or repr(obj)
                     )
-                ret.append(node.data)
+                ret.append(obj)
 
         if output_strs:
             print(self.branchname.upper())
@@ -96,24 +109,78 @@ class Branch:
         for subbranch in self.subbranches:
             leftsubbranch = getattr(self, subbranch)
             rightsubbranch = getattr(other, subbranch)
+            yield from leftsubbranch.diff(rightsubbranch)
 
-            for idnumber in leftsubbranch - rightsubbranch:
-                # items only appearing in left
-                l = leftsubbranch.get(idnumber)
-                yield define_action(idnumber=idnumber, value=l, obj=l, source=l, dest=None, method='new_{}'.format(subbranch))
-
-            for idnumber in rightsubbranch - leftsubbranch:
-                # items only appearing in right
-                r = rightsubbranch.get(idnumber)
-                yield define_action(idnumber=idnumber, value=r, obj=r, source=None, dest=r, method='old_{}'.format(subbranch))
-
-            for idnumber in leftsubbranch & rightsubbranch:
-                # common items
-                lobj = leftsubbranch.get(idnumber)
-                robj = rightsubbranch.get(idnumber)
-                yield from lobj - robj
+    def diff(self, other, workers=None, shards=None, ordered=True):
+        """
+        Same actions as self - other, with the attribute diffs of common objects spread over
+        a pool of worker processes, split by subbranch and by idnumber shard
+        New and old objects are worked out here, objects whose fingerprints match are not sent,
+        the others are pickled with their stored values only (computed attributes are worked out again over there)
+        ordered=True yields subbranch by subbranch, sorted by idnumber within each;
+        ordered=False yields each shard's actions as soon as they are in
+
+        Sending an object costs about as much as comparing a few plain attributes, so workers only
+        pay off when comparing is the expensive part: many changed objects with many attributes,
+        long lists or sets, or costly properties; with mostly unchanged objects or cheap attributes,
+        self - other is faster (and is what runs when there are fewer than two cpus)
+
+        Usage:
+        for action in tree.source.diff(tree.destination, workers=8):
+            ...
+        """
+        workers = min(workers or 1, os.cpu_count() or 1)
+        if workers < 2:
+            yield from self - other
+            return
+        if self.subbranches != other.subbranches:
+            raise TypeError("Subbranches cannot be compared with unlike subbranches")
+        shards = shards or workers
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            sent = {}
+            for subbranch in self.subbranches:
+                leftsubbranch = getattr(self, subbranch)
+                rightsubbranch = getattr(other, subbranch)
+                pairs = [[] for _ in range(shards)]
+                sent[subbranch] = objects = {}
+                common = leftsubbranch & rightsubbranch
+                for idnumber in sorted(common) if ordered else common:
+                    lobj = leftsubbranch.get(idnumber)
+                    robj = rightsubbranch.get(idnumber)
+                    fingerprint = getattr(lobj, '_fingerprint', None)
+                    if fingerprint is not None and fingerprint == getattr(robj, '_fingerprint', None):
+                        continue
+                    objects[idnumber] = (lobj, robj)
+                    pairs[zlib.crc32(str(idnumber).encode()) % shards].append((lobj, robj))
+                futures[subbranch] = [pool.submit(diff_pairs, shard) for shard in pairs if shard]
+
+            for subbranch in self.subbranches:
+                leftsubbranch = getattr(self, subbranch)
+                rightsubbranch = getattr(other, subbranch)
+                new_and_old = leftsubbranch.new_and_old(rightsubbranch)
+                yield from sorted(new_and_old, key=lambda a: a.method[:4] + a.idnumber) if ordered else new_and_old
+
+                results = futures[subbranch] if ordered else as_completed(futures[subbranch])
+                objects = sent[subbranch]
+                actions = (
+                    define_action(idnumber=idnumber, obj=objects[idnumber][0], source=objects[idnumber][0],
+                                  dest=objects[idnumber][1], method=method, attribute=attribute,
+                                  value=value, old_value=old_value)
+                    for future in results
+                    for idnumber, method, attribute, value, old_value in future.result()
+                )
+                yield from sorted(actions, key=lambda a: a.idnumber) if ordered else actions
 
     def __pos__(self):
+        subbranches = [getattr(self, sb) for sb in self.subbranches]
+        if self.tree.import_workers:
+            import_concurrently(subbranches, self.tree.import_workers)
+            return
+        if any(subbranch.asynchronous for subbranch in subbranches):
+            import_asynchronously(subbranches)
+            return
         for subbranch in self.subbranches:
             +getattr(self, subbranch)
 
@@ -0,0 +1,76 @@
+"""
+Caches imported trees on disk, so that subbranches whose sources have not changed are not imported again
+"""
+
+import hashlib
+import json
+import os
+from synctree.utils import class_to_string
+
+
+class ImportCache:
+    """
+    Each subbranch is keyed by its importer's class, settings and source_signature()
+    Subbranches whose key matches the one stored with the cached snapshot are read from it,
+    the rest are imported; importers without a source signature are always imported
+    Importers' on_import_complete hooks run once every subbranch is in place, cached or imported,
+    and what they change is not cached
+
+    Usage:
+    cache = ImportCache(tree, '/path/to/imported.snapshot')
+    cache.import_tree()  # instead of +tree
+    """
+    def __init__(self, tree, path, read=True, write=True):
+        self.tree = tree
+        self.path = path
+        self.read = read
+        self.write = write
+
+    def subbranches(self):
+        for branch in self.tree.branches:
+            br = getattr(self.tree, branch)
+            for subbranch in br.subbranches:
+                yield (branch, subbranch), getattr(br, subbranch)
+
+    def key(self, subbranch):
+        importer = subbranch.importer
+        signature = getattr(importer, 'source_signature', lambda: None)()
+        if signature is None:
+            return None
+        settings = getattr(importer, '_settings', None)
+        description = json.dumps([class_to_string(type(importer)), settings, signature], sort_keys=True, default=str)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def cached_keys(self):
+        if not self.read or not os.path.exists(self.path):
+            return {}
+        try:
+            return self.tree.snapshot_rootdata(self.path)['info'].get('import_keys', {})
+        except (ValueError, EOFError, KeyError):
+            return {}
+
+    def import_tree(self):
+        """
+        Returns the (branch, subbranch) sections that were read from the cache
+        """
+        keys = {section: self.key(subbranch) for section, subbranch in self.subbranches()}
+        cached = self.cached_keys()
+        reuse = {section for section, key in keys.items() if key is not None and cached.get(section) == key}
+        if reuse:
+            try:
+                self.tree.load(self.path, sections=reuse)
+            except ValueError:
+                # Snapshot of a differently shaped tree
+                reuse = set()
+
+        for section, subbranch in self.subbranches():
+            if section not in reuse:
+                subbranch.load(subbranch.rows(), complete=False)
+
+        # Stored before the hooks run, so that they see the same objects on a cache hit as after an import
+        if self.write:
+            self.tree.store(self.path, binary=True, import_keys=keys)
+
+        for section, subbranch in self.subbranches():
+            subbranch.complete()
+        return reuse
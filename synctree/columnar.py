@@ -0,0 +1,91 @@
+"""
+Columnar representation of a subbranch, used to diff very large subbranches
+Requires numpy, which is imported only when a columnar subbranch is used
+
+Rows are joined on idnumber and compared one attribute column at a time;
+only rows that differ somewhere are handed to Basebase.__sub__, so the
+actions that come out are exactly the ones the row-by-row diff produces
+Only stored values are held: rows of models that compute attributes
+(see computes_attributes) are always handed over, as they can change at any time
+"""
+
+import numpy as np
+from synctree.base import class_attributes, instance_attributes, computes_attributes
+
+
+_missing = object()
+
+
+def _column(values, count):
+    return np.fromiter(values, dtype=object, count=count)
+
+
+class Columns:
+    """
+    One numpy array per attribute (plus their types), rows sorted by idnumber
+    """
+    def __init__(self, objects):
+        objects = sorted(objects, key=lambda o: o.idnumber)
+        count = len(objects)
+        self.idnumbers = _column((o.idnumber for o in objects), count)
+        self.objects = _column(objects, count)
+
+        klasses = {type(o) for o in objects}
+        computing = {klass for klass in klasses if computes_attributes(klass)}
+        self.computed = np.fromiter((type(o) in computing for o in objects), dtype=bool, count=count)
+        stored = [o for o in objects if type(o) not in computing]
+
+        attributes = {}
+        for klass in klasses - computing:
+            attributes.update(dict.fromkeys(class_attributes(klass)))
+        for obj in stored:
+            attributes.update(dict.fromkeys(instance_attributes(obj)))
+
+        self.values = {}
+        self.kinds = {}
+        for attribute in attributes:
+            values = [getattr(o, attribute, _missing) for o in objects]
+            self.values[attribute] = _column(values, count)
+            self.kinds[attribute] = _column((type(v) for v in values), count)
+
+    def __len__(self):
+        return len(self.idnumbers)
+
+    def missing(self, attribute):
+        """ Rows without attribute, as a boolean mask """
+        if attribute not in self.kinds:
+            return np.ones(len(self), dtype=bool)
+        return self.kinds[attribute] == type(_missing)
+
+    def join(self, other):
+        """
+        Returns (new, old, common), where new and old are arrays of objects only
+        found on this or the other side, and common is a pair of aligned object
+        arrays holding only the rows that differ in at least one attribute
+        """
+        # numpy's set routines are quadratic on object arrays, so the rows are paired up through a dict
+        rows = {idnumber: row for row, idnumber in enumerate(other.idnumbers.tolist())}
+        left, right = [], []
+        for row, idnumber in enumerate(self.idnumbers.tolist()):
+            match = rows.get(idnumber)
+            if match is not None:
+                left.append(row)
+                right.append(match)
+        left, right = np.array(left, dtype=np.intp), np.array(right, dtype=np.intp)
+
+        only_here = np.ones(len(self), dtype=bool)
+        only_here[left] = False
+        only_there = np.ones(len(other), dtype=bool)
+        only_there[right] = False
+        new, old = self.objects[only_here], other.objects[only_there]
+
+        differs = self.computed[left] | other.computed[right]
+        for attribute, values in self.values.items():
+            # Rows missing an attribute on either side are always handed over, to report it
+            differs |= self.missing(attribute)[left] | other.missing(attribute)[right]
+            if attribute not in other.values:
+                continue
+            differs |= self.kinds[attribute][left] != other.kinds[attribute][right]
+            differs |= values[left] != other.values[attribute][right]
+
+        return new, old, (self.objects[left][differs], other.objects[right][differs])
@@ -0,0 +1,138 @@
+"""
+Delta syncing: keep the destination branch from one run to the next instead of importing it each time
+"""
+
+import copy
+import inspect
+import os
+from synctree.base import initobj, class_attributes, slot_descriptors
+
+
+class _TrackingReporter:
+    """
+    Passes everything on to the template's own reporter, applying successful actions on the way
+    """
+    def __init__(self, reporter, delta):
+        self._reporter = reporter
+        self._delta = delta
+
+    def __getattr__(self, name):
+        return getattr(self._reporter, name)
+
+    def success(self, action, result):
+        self._delta.apply(action)
+        return self._reporter.success(action, result)
+
+
+class DeltaSync:
+    """
+    Stores the destination branch as it stands after a sync, so that the next run can diff
+    the freshly imported source against it, rather than importing the destination again
+    With full_every=N, every Nth run imports the destination in full, to correct any drift
+
+    Usage:
+    delta = DeltaSync(tree, '/path/to/destination.snapshot', full_every=7)
+    delta.import_branches()  # instead of +tree
+    (tree.source > tree.destination) | delta.track(template)
+    delta.store()
+    """
+    def __init__(self, tree, path, destination=None, full_every=None):
+        self.tree = tree
+        self.path = path
+        self.destination = destination or tree.branches[-1]
+        self.full_every = full_every
+        self.runs_since_full = 0
+
+    def previous_runs_since_full(self):
+        """ None if there is no snapshot to start from """
+        if not os.path.exists(self.path):
+            return None
+        return self.tree.snapshot_rootdata(self.path)['info'].get('runs_since_full', 0)
+
+    def import_branches(self):
+        """
+        +tree, except that the destination comes from the snapshot unless a full import is due
+        Returns True if the destination was imported in full
+        """
+        previous = self.previous_runs_since_full()
+        if previous is None or (self.full_every and previous + 1 >= self.full_every):
+            +self.tree
+            self.runs_since_full = 0
+            return True
+
+        self.tree.load(self.path, branches=[self.destination])
+        for branch in self.tree.branches:
+            if branch != self.destination:
+                +getattr(self.tree, branch)
+        self.runs_since_full = previous + 1
+        return False
+
+    def track(self, template):
+        """
+        Outfits template so that each action it carries out successfully is applied to the destination branch
+        """
+        template.reporter = _TrackingReporter(template.reporter, self)
+        return template
+
+    def store(self):
+        self.tree.store(self.path, binary=True, branches=[self.destination], runs_since_full=self.runs_since_full)
+
+    def apply(self, action):
+        """
+        Bring the destination branch in line with an action that has been carried out
+        Attributes that are properties on the destination's model cannot be set, and are left alone
+        """
+        if action.method.startswith('new_'):
+            subbranch = action.method[len('new_'):]
+            if self.tree.get(self.destination, subbranch, action.idnumber) is None:
+                kwargs = self.kwargs_for(subbranch, action.source)
+                self.tree.new(self.destination, subbranch, action.idnumber, **kwargs)
+            return
+
+        if action.method.startswith('old_'):
+            subbranch = action.method[len('old_'):]
+            if self.tree.get(self.destination, subbranch, action.idnumber) is not None:
+                self.tree.remove_node(self.tree.keypath(self.destination, subbranch, action.idnumber))
+            return
+
+        obj, attribute = action.dest, action.attribute
+        if obj is None or not attribute or isinstance(inspect.getattr_static(type(obj), attribute, None), property):
+            return
+        if action.method.startswith('update_'):
+            value = action.value
+        elif action.method.startswith('add_'):
+            value = copy.copy(getattr(obj, attribute))
+            if isinstance(value, set):
+                value.add(action.value)
+            elif action.value not in value:
+                value.append(action.value)
+        elif action.method.startswith('remove_'):
+            value = copy.copy(getattr(obj, attribute))
+            if isinstance(value, set):
+                value.discard(action.value)
+            else:
+                value = [v for v in value if v != action.value]
+        else:
+            return  # errors are not applied
+
+        obj._update(**{attribute: value})
+
+    def kwargs_for(self, subbranch, source):
+        """
+        What the destination's model needs to make a copy of source: the source's values,
+        less whatever the model computes, or has no room for when its instances have no __dict__
+        """
+        klass = self.tree._model_klasses[self.destination][subbranch]
+        kwargs = dict(source._kwargs)
+        if isinstance(klass, initobj):
+            return kwargs
+        for attribute in class_attributes(klass):
+            if attribute != 'idnumber' and attribute not in kwargs and hasattr(source, attribute):
+                kwargs[attribute] = getattr(source, attribute)
+        open_ended = any('__dict__' in vars(base) for base in klass.__mro__[:-1])
+        slots = {name for name, _ in slot_descriptors(klass)}
+        return {
+            attribute: value for attribute, value in kwargs.items()
+            if not isinstance(inspect.getattr_static(klass, attribute, None), property)
+            and (open_ended or attribute in slots)
+        }
@@ -1,3 +1,4 @@
 from .default_importer import DefaultImporter
+from .jsonlines_importer import JSONLinesImporter, export_jsonlines
 
-__all__ = [DefaultImporter]
\ No newline at end of file
+__all__ = [DefaultImporter, JSONLinesImporter, export_jsonlines]
@@ -0,0 +1,61 @@
+"""
+Opens files for importers, decompressing gzip and zstandard files as they are read
+zstandard is only needed (and imported) when a zstandard file is opened
+"""
+
+import gzip
+import io
+
+buffer_size = 1024 * 1024
+
+_magic = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+}
+
+_extensions = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+
+
+def compression(path):
+    """
+    'gzip', 'zstd' or None, going by the file's first bytes, or by its extension when it is too short to tell
+    """
+    with open(path, 'rb') as f:
+        start = f.read(4)
+    for magic, kind in _magic.items():
+        if start.startswith(magic):
+            return kind
+    if len(start) < 4:
+        for extension, kind in _extensions.items():
+            if str(path).endswith(extension):
+                return kind
+    return None
+
+
+def open_binary(path, size=None):
+    """
+    The file at path, decompressed as it is read, with a read buffer of size bytes
+    """
+    size = size or buffer_size
+    kind = compression(path)
+    if kind == 'gzip':
+        return io.BufferedReader(gzip.GzipFile(path, 'rb'), size)
+    if kind == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {path} requires the zstandard package")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=size), size)
+    return open(path, 'rb', buffering=size)
+
+
+def open_text(path, encoding=None, newline='', size=None):
+    """
+    As open(path, encoding=encoding, newline=newline), but decompressing as it goes
+    """
+    return io.TextIOWrapper(open_binary(path, size), encoding=encoding, newline=newline)
@@ -1,16 +1,82 @@
 from .default_importer import DefaultImporter
+from .compressed import compression, open_text
+from synctree.subbranch import read_concurrently, reader_rows
 import csv
-import inspect
+import io
+import itertools
+import locale
+import mmap
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import pickle
+import functools
 from contextlib import contextmanager
-from collections import defaultdict
+from collections import deque
 
 verbose = False
 
 
+def record_boundaries(path, chunk_size, quotechar='"', header=False):
+    """
+    Byte offsets splitting the file at path into chunks of about chunk_size that each hold whole records,
+    starting with 0 and ending with the file size; with header, the first chunk is the first record alone
+    A newline ends a record unless it is inside quotes, which is so when an odd number of quote
+    characters come before it (doubled quotes inside quoted fields count twice)
+    """
+    quote = quotechar.encode()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return [0, 0]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            boundaries = [0]
+            scanned, quotes = 0, 0
+            target = 0 if header else chunk_size
+            while True:
+                newline = data.find(b'\n', max(target, scanned))
+                while newline != -1:
+                    quotes += data[scanned:newline].count(quote)
+                    scanned = newline
+                    if quotes % 2 == 0:
+                        break
+                    newline = data.find(b'\n', newline + 1)
+                if newline == -1 or newline + 1 >= size:
+                    break
+                boundaries.append(newline + 1)
+                target = newline + 1 + chunk_size
+            boundaries.append(size)
+            return boundaries
+
+
+def _parse_chunk(path, start, end, encoding, delimiter, fieldnames=None, projection=None):
+    """
+    Runs in a worker process: the records between the byte offsets start and end,
+    as rows of values, or as kwargs when fieldnames are given
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode(encoding)
+    reader = csv.reader(io.StringIO(text, newline=''), delimiter=delimiter)
+    if fieldnames is None:
+        return list(reader)
+    return list(CSVImporter.to_kwargs(reader, fieldnames, projection))
+
+
 class CSVImporter(DefaultImporter):
+    """
+    Reads the file at the path setting, with the {subbranch}_columns setting (space separated)
+    as its columns if given; a truthy sidecar setting keeps the parsed rows in a file next to it
+    that is used for as long as the file and the settings stay the same
+    The projection setting (space separated, or __slots__ for the model's slots) limits rows to those columns
+    Files compressed with gzip or zstandard (.gz, .zst) are decompressed as they are read,
+    through a buffer_size (bytes) setting sized buffer
+    """
     _settings = {
         'delimiter': ','
     }
+    chunk_size = 64 * 1024 * 1024  # the chunk_size setting overrides, see parallel_workers
+    file_hook = None  # called with the path setting, returns the path to read
 
     def init(self):
         delim = self.get_setting('delimiter') 
@@ -20,7 +86,13 @@ class CSVImporter(DefaultImporter):
             self.update_setting('delimiter', ',')
 
     def get_path(self):
-        return self.get_setting('path')
+        path = self.get_setting('path')
+        return path if self.file_hook is None else self.file_hook(path)
+
+    def source_signature(self):
+        resolved_path = self.get_path()
+        stat = os.stat(resolved_path)
+        return [resolved_path, stat.st_size, stat.st_mtime_ns]
 
     @contextmanager
     def reader(self):
@@ -40,52 +112,247 @@ class CSVImporter(DefaultImporter):
         else:
             fieldnames = fieldnames.split(' ')
 
-        with open(resolved_path) as f:
-            reader = csv.DictReader(f, 
-                fieldnames=fieldnames,
-                delimiter=self.get_setting('delimiter'))
-            yield reader
+        projection = self.projection()
+
+        signature = None
+        if self.get_setting('sidecar'):
+            # Opt-in cache of the parsed rows next to the file, see sidecar_path
+            signature = [*self.source_signature(), fieldnames, self.get_setting('delimiter'), projection and sorted(projection)]
+            columns = self.read_sidecar(signature)
+            if columns is not None:
+                yield self.rows_from_columns(columns)
+                return
+
+        workers = self.parallel_workers(resolved_path)
+        if workers:
+            rows = self.parse_in_parallel(resolved_path, fieldnames, projection, workers)
+            try:
+                yield rows if signature is None else self.write_sidecar_after(rows, signature)
+            finally:
+                rows.close()  # shuts the pool down
+            return
+        with open_text(resolved_path, self.get_setting('encoding'), size=self.buffer_size()) as f:
+            rows = self.parse(f, fieldnames, projection)
+            yield rows if signature is None else self.write_sidecar_after(rows, signature)
+
+    def projection(self):
+        """
+        The set of columns rows are limited to, None for all of them
+        """
+        projection = self.get_setting('projection')
+        if not projection:
+            return None
+        if projection != '__slots__':
+            return set(projection.split(' '))
+        klass = self._tree._model_klasses[self._branch.branchname][self._subbranch.subbranchname]
+        slots = {'idnumber'}
+        for base in getattr(klass, '__mro__', ()):
+            declared = getattr(base, '__slots__', ())
+            slots.update([declared] if isinstance(declared, str) else declared)
+        if '__dict__' in slots or not isinstance(klass, type):
+            # Instances take any column
+            return None
+        return {slot for slot in slots if not slot.startswith('_')}
+
+    def parse(self, f, fieldnames=None, projection=None):
+        """
+        Rows of f as dicts, as csv.DictReader makes them, but with csv.reader and the header
+        worked out once; with projection, only those columns are kept
+        """
+        reader = csv.reader(f, delimiter=self.get_setting('delimiter'))
+        if not fieldnames:
+            fieldnames = next(reader, None)
+            if fieldnames is None:
+                return
+        yield from self.to_kwargs(reader, fieldnames, projection)
+
+    @staticmethod
+    def to_kwargs(reader, fieldnames, projection=None):
+        """ The kwargs for each of the rows of values reader gives """
+        width = len(fieldnames)
+
+        if projection is not None:
+            indexes = [i for i, name in enumerate(fieldnames) if name in projection]
+            names = [fieldnames[i] for i in indexes]
+            if not indexes:
+                getter = lambda row: ()
+            elif len(indexes) == 1:
+                getter = lambda row, i=indexes[0]: (row[i], )
+            else:
+                getter = itemgetter(*indexes)
+            for row in reader:
+                if len(row) >= width:
+                    yield dict(zip(names, getter(row)))
+                elif row:
+                    # Short rows are padded with None, as DictReader does
+                    yield {name: row[i] if i < len(row) else None for name, i in zip(names, indexes)}
+            return
+
+        for row in reader:
+            if len(row) == width:
+                yield dict(zip(fieldnames, row))
+            elif row:
+                kwargs = dict(zip(fieldnames, row))
+                if len(row) > width:
+                    kwargs[None] = row[width:]
+                else:
+                    for name in fieldnames[len(row):]:
+                        kwargs[name] = None
+                yield kwargs
+
+    def buffer_size(self):
+        return int(self.get_setting('buffer_size', 0)) or None
+
+    def parallel_workers(self, resolved_path):
+        """
+        With the parallel setting (a number of processes, or true for one per cpu), uncompressed files
+        of at least two chunk_size (bytes) are parsed chunk by chunk in a pool of processes;
+        None when the file should be read serially
+        """
+        parallel = self.get_setting('parallel')
+        if not parallel or str(parallel).lower() in ('0', 'false', 'no', 'off'):
+            return None
+        chunk_size = int(self.get_setting('chunk_size', self.chunk_size))
+        if os.path.getsize(resolved_path) < 2 * chunk_size or compression(resolved_path):
+            # Compressed files can only be read from the start
+            return None
+        if parallel is True or str(parallel).lower() in ('true', 'yes', 'on'):
+            return os.cpu_count() or 1
+        return int(parallel)
+
+    def parse_in_parallel(self, resolved_path, fieldnames, projection, workers):
+        """
+        Rows as parse gives them, parsed in chunks by a pool of workers processes
+        In file order, unless the ordered setting is false and the importer is not sorted_by_idnumber,
+        in which case each chunk's rows come as soon as it is parsed
+        """
+        chunk_size = int(self.get_setting('chunk_size', self.chunk_size))
+        delimiter = self.get_setting('delimiter')
+        encoding = self.get_setting('encoding') or locale.getpreferredencoding(False)
+        ordered = self.sorted_by_idnumber or str(self.get_setting('ordered', True)).lower() not in ('0', 'false', 'no', 'off')
+
+        boundaries = record_boundaries(resolved_path, chunk_size, header=not fieldnames)
+        if not fieldnames:
+            fieldnames = next(iter(_parse_chunk(resolved_path, 0, boundaries[1], encoding, delimiter)), None)
+            if fieldnames is None:
+                return
+            boundaries = boundaries[1:]
+        chunks = zip(boundaries, boundaries[1:])
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            try:
+                while True:
+                    # Parse up to twice as many chunks as there are workers ahead of the rows handed out
+                    for a, b in itertools.islice(chunks, 2 * workers - len(pending)):
+                        pending.append(pool.submit(_parse_chunk, resolved_path, a, b, encoding, delimiter, fieldnames, projection))
+                    if not pending:
+                        return
+                    if ordered:
+                        future = pending.popleft()
+                    else:
+                        future = next(as_completed(pending))
+                        pending.remove(future)
+                    yield from future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def sidecar_path(self):
+        return self.get_path() + '.parsed'
 
+    def read_sidecar(self, signature):
+        """
+        The parsed columns stored next to the file, if they were parsed from it as it is now
+        """
+        try:
+            with open(self.sidecar_path(), 'rb') as f:
+                stored_signature, columns = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        return columns if stored_signature == signature else None
+
+    @staticmethod
+    def rows_from_columns(columns):
+        names = list(columns)
+        for values in zip(*columns.values()):
+            yield dict(zip(names, values))
+
+    def write_sidecar_after(self, reader, signature):
+        """
+        Passes rows through, column by column keeping them to be stored once the file has been read in full
+        Rows with more values than columns cannot be stored that way, and turn the sidecar off
+        """
+        columns = None
+        for row in reader:
+            if columns is None:
+                columns = {name: [] for name in row}
+            if columns is not False:
+                if row.keys() != columns.keys():
+                    columns = False
+                else:
+                    for name, value in row.items():
+                        columns[name].append(value)
+            yield row
+        if columns is False:
+            return
+        temp_path = self.sidecar_path() + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump((signature, columns or {}), f, protocol=5)
+        os.replace(temp_path, self.sidecar_path())
 
-class TranslatedCSVImporter:
+
+class TranslatedCSVImporter(DefaultImporter):
     """
     Meta CSV importer used in situations where information for a particular branch
     is spread out over more than one file. 
+    One klass importer is made for each translated path, that is the path setting with key
+    replaced by each of its values, and their files are read at once in threads
+    (klass's parallel setting has each of them parse in processes as well)
 
     Usage:
     class MyStudentsImporter(TranslatedCSVImporter):
+        klass = MyCSVImporter  # path setting '/path/to/district/students.csv'
         translate = {'district': ['elementary', 'secondary']}
     """
     translate = {'': ['']}  # overrride
     klass = None
-    csv_importers = defaultdict(list)
+    ordered = True  # rows of one file after the other, rather than as they are read
+    max_workers = None
 
     def __init__(self, tree, branch, subbranch):
         """
         Mimick the DefaultImporter's __init__, passed onto TranslatedCSVImporter.__init__
         """
-        self._tree = tree
-        self._branch = branch
-        for key, value in self.translate.items:
-            inst = self.klass(tree, branch, subbranch)
-            verbose and print("\tInside {} made instance of {} which has {}".format(self._branch.fullname, self.klass.__name__, inst._branch.fullname))
+        self.csv_importers = []
+        super().__init__(tree, branch, subbranch)
+        for key, values in self.translate.items():
+            for value in values:
+                inst = self.klass(tree, branch, subbranch)
+                verbose and print("\tInside {} made instance of {} which has {}".format(self._branch.branchname, self.klass.__name__, inst._branch.branchname))
+
+                # Bind key and value as they are now, otherwise every hook would see the last ones
+                inst.file_hook = (lambda k, v: lambda p: p.replace(k, v))(key, value)
+
+                self.csv_importers.append(inst)
 
-            # Verbose way of ensuring that value changes to the value at the time this is run
-            # otherwise we would always return the same thing
-            inst.file_hook = (lambda v: lambda p : p.replace(key, v))(value)
-            # 
+    @property
+    def sorted_by_idnumber(self):
+        return self.klass.sorted_by_idnumber and len(self.csv_importers) <= 1
 
-            self.csv_importers[self.__class__.__name__].append(inst)
+    def kwargs_preprocessor(self, kwargs_in):
+        return self.csv_importers[0].kwargs_preprocessor(kwargs_in) if self.csv_importers else kwargs_in
+
+    def source_signature(self):
+        signatures = [csv_importer.source_signature() for csv_importer in self.csv_importers]
+        return None if None in signatures else signatures
 
     def reader(self):
         """
         Step through them all and call their reader method
         """
         verbose and print("Reading in with {} importers".format(len(self.csv_importers)))
-        for csv_importer in self.csv_importers[self.__class__.__name__]:
-            if inspect.isgeneratorfunction(csv_importer.reader):
-                yield from csv_importer.reader()
-            else:
-                with csv_importer.reader() as reader:
-                    yield from reader
-
+        yield from read_concurrently(
+            [functools.partial(reader_rows, csv_importer) for csv_importer in self.csv_importers],
+            max_workers=self.max_workers, ordered=self.ordered
+        )
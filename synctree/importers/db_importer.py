@@ -1,26 +1,79 @@
 from .default_importer import DefaultImporter
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
+import threading
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def shared_engine(engine_string, **options):
+	"""
+	The process-wide engine for engine_string, made on first use with options (pool_size and the like)
+	Importers pointed at the same database share it, along with its pooled connections;
+	options passed for an engine that already exists are ignored
+	"""
+	with _engines_lock:
+		engine = _engines.get(engine_string)
+		if engine is None:
+			engine = _engines[engine_string] = create_engine(engine_string, **options)
+		return engine
+
+
+def dispose_engines():
+	"""
+	Close the pooled connections of every shared engine, and forget them
+	"""
+	with _engines_lock:
+		for engine in _engines.values():
+			engine.dispose()
+		_engines.clear()
+
+
+def _flag(value):
+	if isinstance(value, str):
+		return value.strip().lower() in ('1', 'true', 'yes', 'on')
+	return bool(value)
 
 
 class DBImporter(DefaultImporter):
 	"""
 	A basic DB importer using basic sqlalchemy
+	The reader streams what query returns (or the sql text) with a server-side cursor,
+	batch_size rows at a time, so that the result set is never held in memory all at once
 	"""
 	default_port = None
 	dialect = None
+	sql = None  # text SQL for the reader, or override query
+	batch_size = 10000  # the batch_size setting overrides
+	column_names = {}  # column: kwarg, for columns whose names differ from the model's
+	pool_size = None  # these three are passed to create_engine, settings of the same name override
+	pool_pre_ping = True
+	pool_recycle = None
 
 	def init(self):
 		"""
 		Set up the database information
 		"""
-		self.engine = create_engine(self.engine_string)
+		self.engine = shared_engine(self.engine_string, **self.engine_options())
 		self.session_maker = sessionmaker(
 		    bind=self.engine,
 		    expire_on_commit=False
 		    )
 
+	def engine_options(self):
+		"""
+		Options for create_engine, settings read from a file arrive as strings
+		"""
+		options = {}
+		for option, convert in (('pool_size', int), ('pool_recycle', int), ('pool_pre_ping', _flag)):
+			value = self.get_setting(option, getattr(self, option))
+			if value is not None:
+				options[option] = convert(value)
+		return options
+
 	@contextmanager
 	def db_session(self):
 	    session = self.session_maker()
@@ -33,6 +86,32 @@ class DBImporter(DefaultImporter):
 	    finally:
 	        session.close()
 
+	def query(self, session):
+		"""
+		What the reader runs: a select, a (legacy) Query, or text SQL
+		"""
+		return self.sql
+
+	def row_to_kwargs(self, row):
+		"""
+		Mapping of column: value for one row to the kwargs for the model
+		"""
+		return {self.column_names.get(column, column): value for column, value in row.items()}
+
+	def reader(self):
+		batch_size = int(self.get_setting('batch_size', self.batch_size))
+		with self.db_session() as session:
+			statement = self.query(session)
+			if statement is None:
+				return
+			if isinstance(statement, str):
+				statement = text(statement)
+			statement = getattr(statement, 'statement', statement)  # legacy Query
+			result = session.execute(statement.execution_options(stream_results=True, yield_per=batch_size))
+			for rows in result.mappings().partitions(batch_size):
+				for row in rows:
+					yield self.row_to_kwargs(row)
+
 	@property
 	def engine_string(self):
 		user = self.get_setting('db_user')
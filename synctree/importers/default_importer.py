@@ -5,6 +5,8 @@ An abstract importer, can be used as is, but does nothing
 
 class DefaultImporter:
     _settings = None
+    sorted_by_idnumber = False  # set if the reader yields all rows of an idnumber together
+    intern_values = None  # True, or the names of attributes, whose values are shared between objects as imported
 
     def __init__(self, tree, branch, subbranch):
         self._tree = tree
@@ -34,11 +36,18 @@ class DefaultImporter:
 
     def reader(self):
         """
-        Can be generator, if not generator, then assumed to be contextmanager
+        Can be generator or async generator, if neither, then assumed to be contextmanager
         Must be underscore, because generators are not callables, and we use underscores to skip them
         """
         yield from []
 
+    def source_signature(self):
+        """
+        Something that changes whenever what the reader yields would, used to cache imports
+        None means unknown, and the subbranch is always imported
+        """
+        return None
+
     def resolve_duplicate(self, original_obj, **kwargs):
         """
         Called by the importer
@@ -0,0 +1,69 @@
+"""
+JSON Lines: one JSON object per line, read and written a line at a time
+Uses orjson to parse when it is installed
+"""
+
+from .default_importer import DefaultImporter
+from .compressed import open_binary
+import gzip
+import json
+import os
+
+try:
+    from orjson import loads
+except ImportError:
+    loads = json.loads
+
+
+class JSONLinesImporter(DefaultImporter):
+    """
+    Reads the file at the path setting (which may be compressed, see compressed), one record per line
+    The idnumber_field setting names the field holding the idnumber, and the projection setting
+    (space separated) limits records to those fields
+
+    Usage:
+    class StudentsImporter(JSONLinesImporter):
+        _settings = {'path': '/path/to/students.jsonl', 'idnumber_field': 'student_number'}
+    """
+    _settings = {}
+
+    def get_path(self):
+        return self.get_setting('path')
+
+    def source_signature(self):
+        resolved_path = self.get_path()
+        stat = os.stat(resolved_path)
+        return [resolved_path, stat.st_size, stat.st_mtime_ns]
+
+    def reader(self):
+        idnumber_field = self.get_setting('idnumber_field', 'idnumber')
+        projection = self.get_setting('projection')
+        projection = set(projection.split(' ')) if projection else None
+
+        with open_binary(self.get_path()) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = loads(line)
+                if projection is not None:
+                    record = {key: value for key, value in record.items() if key in projection or key == idnumber_field}
+                if idnumber_field in record:
+                    # Node identifiers are strings
+                    record['idnumber'] = str(record.pop(idnumber_field))
+                yield record
+
+
+def export_jsonlines(objects, path):
+    """
+    Writes each of objects (a subbranch, for example) as one line of its _to_json,
+    as the objects come; a path ending in .gz is written compressed
+    Returns how many were written
+    """
+    opener = gzip.open if str(path).endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for obj in objects:
+            f.write(obj._to_json)
+            f.write('\n')
+            count += 1
+    return count
@@ -1,8 +1,213 @@
-from collections import defaultdict
 import inspect
 from treelib.tree import DuplicatedNodeIdError as Duplicated
 from synctree.importers.default_importer import DefaultImporter
+from synctree.actions import define_action
 import weakref
+import queue
+from collections import Counter, defaultdict
+import threading
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+
+_done = object()
+
+
+class _ReaderFailed:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _put(rows_queue, item, stop):
+    """ Blocks while the queue is full, unless the import has been abandoned """
+    while not stop.is_set():
+        try:
+            rows_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _pump(rows, rows_queue, stop):
+    """ Runs in a reader thread """
+    try:
+        for row in rows():
+            if not _put(rows_queue, row, stop):
+                return
+        item = _done
+    except Exception as e:
+        item = _ReaderFailed(e)
+    _put(rows_queue, item, stop)
+
+
+def _drain(rows_queue):
+    while True:
+        row = rows_queue.get()
+        if row is _done:
+            return
+        if isinstance(row, _ReaderFailed):
+            raise row.exception
+        yield row
+
+
+def reader_rows(importer):
+    """
+    The rows importer's reader provides, whichever kind of reader it is
+    """
+    if inspect.isasyncgenfunction(importer.reader):
+        yield from _async_rows(importer.reader)
+    elif inspect.isgeneratorfunction(importer.reader):
+        # We are using a generator
+        yield from importer.reader()
+    else:
+        # We have a context manager
+        with importer.reader() as reader:
+            yield from reader
+
+
+def read_concurrently(sources, max_workers=None, queue_size=10000, ordered=True):
+    """
+    The rows of each of sources (callables returning iterables of rows), read at once in a pool of
+    max_workers threads, each buffering up to queue_size rows
+    Ordered, all of the first source's rows come first, then the second's and so on;
+    otherwise rows come in whatever order they are read
+    """
+    sources = list(sources)
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            if ordered:
+                queues = [queue.Queue(queue_size) for _ in sources]
+                for rows, rows_queue in zip(sources, queues):
+                    pool.submit(_pump, rows, rows_queue, stop)
+                for rows_queue in queues:
+                    yield from _drain(rows_queue)
+            else:
+                rows_queue = queue.Queue(queue_size)
+                for rows in sources:
+                    pool.submit(_pump, rows, rows_queue, stop)
+                for _ in sources:
+                    yield from _drain(rows_queue)
+        finally:
+            stop.set()
+
+
+def import_concurrently(subbranches, max_workers=None, queue_size=10000):
+    """
+    Equivalent to +subbranch for each of subbranches, but with their importers' readers
+    running in a pool of max_workers threads, each buffering up to queue_size rows
+    Rows are still put into the tree here, one subbranch after the other in the order given,
+    so insertion and on_import_complete hooks happen exactly as they would in sequence
+    """
+    subbranches = list(subbranches)
+    queues = [queue.Queue(queue_size) for _ in subbranches]
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        try:
+            for subbranch, rows_queue in zip(subbranches, queues):
+                subbranch.importer  # instantiate here rather than in the reader thread
+                pool.submit(_pump, subbranch.rows, rows_queue, stop)
+            for subbranch, rows_queue in zip(subbranches, queues):
+                subbranch.load(_drain(rows_queue))
+        finally:
+            stop.set()
+
+
+def _async_rows(reader):
+    """ Steps through an async generator reader on an event loop of its own """
+    loop = asyncio.new_event_loop()
+    rows = reader()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(rows.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(rows.aclose())
+        loop.close()
+
+
+async def _apump(subbranch, rows_queue, batch_size):
+    """
+    Runs on the event loop, putting rows into rows_queue in batches and waiting while it is full
+    Readers that are not async are stepped through in the loop's default executor
+    """
+    try:
+        if subbranch.asynchronous:
+            batch = []
+            async for row in subbranch.importer.reader():
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await rows_queue.put(batch)
+                    batch = []
+            if batch:
+                await rows_queue.put(batch)
+        else:
+            loop = asyncio.get_running_loop()
+            rows = subbranch.rows()
+            try:
+                while True:
+                    batch = await loop.run_in_executor(None, list, itertools.islice(rows, batch_size))
+                    if not batch:
+                        break
+                    await rows_queue.put(batch)
+            finally:
+                rows.close()
+        item = _done
+    except Exception as e:
+        item = _ReaderFailed(e)
+    await rows_queue.put(item)
+
+
+def _drain_batches(loop, rows_queue):
+    while True:
+        batch = asyncio.run_coroutine_threadsafe(rows_queue.get(), loop).result()
+        if batch is _done:
+            return
+        if isinstance(batch, _ReaderFailed):
+            raise batch.exception
+        yield from batch
+
+
+async def _shutdown(tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def import_asynchronously(subbranches, queue_size=10000, batch_size=100):
+    """
+    Equivalent to +subbranch for each of subbranches, with all of their readers driven at once
+    on one event loop (in a thread of its own), async generator readers included
+    Each subbranch buffers up to queue_size rows, after which its reader waits for the tree to catch up
+    Rows are put into the tree here, one subbranch after the other in the order given, as with import_concurrently
+    """
+    subbranches = list(subbranches)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    async def start():
+        queues = [asyncio.Queue(max(1, queue_size // batch_size)) for _ in subbranches]
+        tasks = [asyncio.create_task(_apump(sb, q, batch_size)) for sb, q in zip(subbranches, queues)]
+        return queues, tasks
+
+    try:
+        for subbranch in subbranches:
+            subbranch.importer  # instantiate here rather than on the loop
+        queues, tasks = asyncio.run_coroutine_threadsafe(start(), loop).result()
+        try:
+            for subbranch, rows_queue in zip(subbranches, queues):
+                subbranch.load(_drain_batches(loop, rows_queue))
+        finally:
+            asyncio.run_coroutine_threadsafe(_shutdown(tasks), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
 
 
 class SubBranch:
@@ -11,6 +216,7 @@ class SubBranch:
         self.subbranchname = subbranchname
         self.parent_keypath = self.branch.tree.keypath(self.branch.branchname, self.subbranchname)
         self._importer_klass = importer
+        self.intern_stats = defaultdict(Counter)
 
     def __iter__(self):
         yield from self.get_objects()
@@ -19,14 +225,25 @@ class SubBranch:
     def path_delim(self):
         return self.branch.tree.path_delim
 
+    def __contains__(self, idnumber):
+        return idnumber in self._selected
+
+    @property
+    def _live_idnumbers(self):
+        """ Live index maintained by the tree, do not mutate or hold on to """
+        return self.branch.tree.idnumbers(self.branch.branchname, self.subbranchname)
+
+    @property
+    def _selected(self):
+        """ What the operators work on: the live index, unless idnumbers is overridden """
+        klass = type(self)
+        if klass.idnumbers is SubBranch.idnumbers and klass._idnumbers is SubBranch._idnumbers:
+            return self._live_idnumbers
+        return self.idnumbers
+
     @property
     def _idnumbers(self):
-        ret = {
-            key.split(self.path_delim)[-1] for key in self.branch.tree._nodes \
-                if not key.endswith(self.subbranchname) and \
-                   key.startswith(f"{self.parent_keypath}{self.path_delim}")
-        }
-        return ret
+        return set(self._live_idnumbers)
 
     @property
     def idnumbers(self):
@@ -45,26 +262,19 @@ class SubBranch:
         """
         @returns None if does not exist
         """
-        node_key = self.branch.tree.keypath(self.branch.branchname, self.subbranchname, idnumber)
-        try:
-            # Don't use subtree here
-            return self.branch.tree.get_node(node_key).data
-        except AttributeError:
-            return None
+        # Don't use subtree here
+        return self.branch.tree.get(self.branch.branchname, self.subbranchname, idnumber)
 
     def get_objects(self):
-        _nodes = self.branch.tree._nodes
-        for node in [_nodes[self.path_delim.join([self.branch.branchname, self.subbranchname, key])] for key in self.idnumbers]:
-            if node.data is not None:
-                yield node.data
+        for obj in [self.get(key) for key in self._selected]:
+            if obj is not None:
+                yield obj
 
     def get_objects_force_all(self):
         """ Should be used for """
-        idnumbers = self._idnumbers
-        _nodes = self.branch.tree._nodes
-        for node in [_nodes[self.path_delim.join([self.branch.branchname, self.subbranchname, key])] for key in idnumbers]:
-            if node.data is not None:
-                yield node.data
+        for obj in [self.get(key) for key in self._live_idnumbers]:
+            if obj is not None:
+                yield obj
 
     def find_all(self, search_string: 'attribute: value'):
         """
@@ -102,11 +312,14 @@ class SubBranch:
     def process_kwargs(self, **kwargs_in):
         """
         Responsible for handling the kwargs args
-        Manages _temp in cases with lists
+        Rows with list or set values are merged into _temp, one accumulator per idnumber,
+        and made once their idnumber is complete
         """
         kwargs = self.importer.kwargs_preprocessor(kwargs_in)
         if kwargs is None:
             return
+        if getattr(self.importer, 'intern_values', None):
+            self.intern_values(kwargs)
         has_list_value = len([1 for k in kwargs.keys() if isinstance(kwargs[k], (list, set))]) > 0
         if not 'idnumber' in kwargs:
             idnumber = str(self._index)
@@ -115,59 +328,154 @@ class SubBranch:
             idnumber = kwargs['idnumber']
             del kwargs['idnumber']
         if has_list_value:
-            self._temp[idnumber].append(kwargs)
+            if getattr(self.importer, 'sorted_by_idnumber', False) and idnumber not in self._temp:
+                # The previous idnumber has seen its last row
+                self.make_accumulated()
+            self.accumulate(idnumber, kwargs)
         else:
             obj = self.make(idnumber, **kwargs)
 
+    def intern_values(self, kwargs):
+        """
+        Swap the values of the attributes named by the importer's intern_values (all if True)
+        for the tree's shared copy, members of lists and sets included
+        Counts hits and misses per attribute in intern_stats
+        """
+        attributes = self.importer.intern_values
+        intern = self.branch.tree.intern
+        for key, value in kwargs.items():
+            if key == 'idnumber' or (attributes is not True and key not in attributes):
+                continue
+            stats = self.intern_stats[key]
+            if isinstance(value, (list, set)):
+                members = []
+                for member in value:
+                    member, hit = intern(member)
+                    stats['hits' if hit else 'misses'] += 1
+                    members.append(member)
+                kwargs[key] = type(value)(members)
+            else:
+                kwargs[key], hit = intern(value)
+                stats['hits' if hit else 'misses'] += 1
+
+    def accumulate(self, idnumber, kwargs):
+        """
+        Merge list and set values into the idnumber's accumulator; other values, last one wins
+        """
+        prepared = self._temp.get(idnumber)
+        if prepared is None:
+            prepared = self._temp[idnumber] = {}
+        for key, value in kwargs.items():
+            if isinstance(value, list):
+                prepared.setdefault(key, []).extend(value)
+            elif isinstance(value, set):
+                prepared.setdefault(key, set()).update(value)
+            else:
+                prepared[key] = value
+
+    def make_accumulated(self):
+        """
+        Make the objects from accumulated rows, and let go of them
+        """
+        for idnumber, prepared in self._temp.items():
+            self.make(idnumber, **prepared)
+        self._temp.clear()
+
     def __pos__(self):          # +
-        self._temp = defaultdict(list)
+        self.load(self.rows())
+
+    @property
+    def asynchronous(self):
+        """ Whether the importer's reader is an async generator """
+        return inspect.isasyncgenfunction(self.importer.reader)
+
+    def rows(self):
+        """
+        The rows the importer's reader provides
+        """
+        yield from reader_rows(self.importer)
+
+    def load(self, rows, complete=True):
+        """
+        Puts rows into the tree, then (unless complete is False, see complete) lets the importer know it is complete
+        """
+        self._temp = {}
         self._index = 0
+        self.intern_stats.clear()
 
-        if inspect.isgeneratorfunction(self.importer.reader):
-            # We are using a generator
-            for kwargs_in in self.importer.reader():
-                self.process_kwargs(**kwargs_in)
-        else:
-            # We have a context manager
-            with self.importer.reader() as reader:
-                for kwargs_in in reader:
-                    self.process_kwargs(**kwargs_in)
-
-        if len(self._temp.keys()) > 0:
-            for idnumber in self._temp.keys():
-                prepared = {}
-                kwargs_list = self._temp[idnumber]
-                for item in kwargs_list:
-                    for list_key in [k for k in item.keys() if isinstance(item[k], list)]:
-                        if list_key not in prepared:
-                            prepared[list_key] = []
-                        prepared[list_key].extend(item[list_key])
-                        del item[list_key]
-                    for set_key in [k for k in item.keys() if isinstance(item[k], set)]:
-                        if set_key not in prepared:
-                            prepared[set_key] = set()
-                        prepared[set_key].update(item[set_key])
-                        del item[set_key]
-
-                    # Add the additional ones, too
-                    prepared.update(item)
-
-                    self.make(idnumber, **prepared)
+        for kwargs_in in rows:
+            self.process_kwargs(**kwargs_in)
+
+        self.make_accumulated()
 
+        if complete:
+            self.complete()
+
+    def complete(self):
+        """
+        Runs the importer's on_import_complete hook, if it has one, and stamps fingerprints
+        """
         if hasattr(self.importer, 'on_import_complete'):
             self.importer.on_import_complete()
 
+        self.stamp_fingerprints()
+
+    def stamp_fingerprints(self):
+        """
+        Cache each object's fingerprint so that unchanged objects skip the attribute diff
+        """
+        for obj in self.get_objects_force_all():
+            obj._stamp_fingerprint()
+
+    def unchanged(self, other):
+        """
+        Common idnumbers whose objects have identical fingerprints
+        """
+        for idnumber in self._selected & other._selected:
+            this_fingerprint = getattr(self.get(idnumber), '_fingerprint', None)
+            if this_fingerprint is not None and this_fingerprint == getattr(other.get(idnumber), '_fingerprint', None):
+                yield idnumber
+
+    def diff(self, other):
+        """
+        Generator of actions that would align other with self:
+        1) Exist on the leftside only (and are thus "new")
+        2) Exist on the rightside only (and are thus "old")
+        3) Exist in both, but have different values for different items (and thus need to be modified)
+        """
+        yield from self.new_and_old(other)
+
+        for idnumber in self & other:
+            # common items
+            lobj = self.get(idnumber)
+            robj = other.get(idnumber)
+            yield from lobj - robj
+
+    def new_and_old(self, other):
+        """
+        The "new" and "old" actions of diff
+        """
+        for idnumber in self - other:
+            # items only appearing in left
+            l = self.get(idnumber)
+            yield define_action(idnumber=idnumber, value=l, obj=l, source=l, dest=None, method='new_{}'.format(self.subbranchname))
+
+        for idnumber in other - self:
+            # items only appearing in right
+            r = other.get(idnumber)
+            yield define_action(idnumber=idnumber, value=r, obj=r, source=None, dest=r, method='old_{}'.format(self.subbranchname))
+
     def __sub__(self, other):   # -
         """
         idnumbers not found in other
         """
-        yield from self.idnumbers - other.idnumbers
+        yield from self._selected - other._selected
 
     def __and__(self, other):   # &
         """
         Common idnumbers
         """
-        yield from self.idnumbers & other.idnumbers
+        yield from self._selected & other._selected
 
     def __repr__(self):
         return "{0.__class__.__name__}({0.branch}, {0.subbranchname})".format(self)
@@ -211,3 +519,35 @@ class SubBranchNarrow(SubBranch):
 
     def __iter__(self):
         yield from self.get_objects_force_all()
+
+
+class SubBranchColumnar(SubBranch):
+    """
+    For very large subbranches: when diffed, records are also held as numpy columns
+    so that diffing joins and compares whole columns at a time (requires numpy)
+    Enable by using :columnar after the subbranch name
+    """
+
+    @property
+    def columns(self):
+        """ Rebuilt when objects were added, removed or changed since the last time """
+        from synctree.columnar import Columns
+        version = self.branch.tree.version(self.branch.branchname, self.subbranchname)
+        columns = getattr(self, '_columns', None)
+        if columns is None or self._columns_version != version:
+            columns = self._columns = Columns(self.get_objects())
+            self._columns_version = version
+        return columns
+
+    def diff(self, other):
+        if not isinstance(other, SubBranchColumnar):
+            yield from super().diff(other)
+            return
+
+        new, old, (lobjs, robjs) = self.columns.join(other.columns)
+        for l in new:
+            yield define_action(idnumber=l.idnumber, value=l, obj=l, source=l, dest=None, method='new_{}'.format(self.subbranchname))
+        for r in old:
+            yield define_action(idnumber=r.idnumber, value=r, obj=r, source=None, dest=r, method='old_{}'.format(self.subbranchname))
+        for lobj, robj in zip(lobjs, robjs):
+            yield from lobj - robj
@@ -2,12 +2,14 @@ import treelib
 from treelib import Tree
 from synctree.base import Base
 from synctree.branch import Branch
-from synctree.subbranch import SubBranch
-from synctree.utils import class_string_to_class
+from synctree.subbranch import SubBranch, import_concurrently, import_asynchronously
+from synctree.utils import class_string_to_class, class_to_string
 
 import json
+import os
+import struct
 from collections import defaultdict
-from synctree.base import initobj
+from synctree.base import initobj, Basebase
 import pickle
 
 from synctree.utils import JsonEncoder
@@ -15,6 +17,10 @@ from synctree.utils import JsonEncoder
 class SyncTree(Tree):
     path_delim = '/'
     rootname = 'root'
+    snapshot_magic = b'SYNCTREE'
+    snapshot_version = 2
+    snapshot_batch = 10000
+    backends = ('treelib', 'dict')
 
     def __init__(self, 
                  branches, 
@@ -23,14 +29,32 @@ class SyncTree(Tree):
                  importer_klass_list: '( (classstr, classstr, ..), (classstr, classstr, ..) )' = None,
                  branch_class=None,
                  jsonify_root_data=False,
-                 raise_error_on_duplicates=True):
+                 raise_error_on_duplicates=True,
+                 backend='treelib',
+                 import_workers=None):
         """
         Makes a tree-like structure that mirrors, used to hold data used to send on operations
         to a synctree template
+
+        backend='dict' keeps the objects in nested dicts instead of treelib nodes,
+        a treelib view is then built only when needed for show, subtree or to_dict
+
+        import_workers=N runs up to N importers' readers at once in threads when importing with +
         """
         super().__init__()
+        if backend not in self.backends:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {self.backends}")
+        self.backend = backend
+        self.import_workers = import_workers
+        self._records = defaultdict(dict)
+        self._view = None
+        self._pending = {}  # (branch, subbranch): (path, offset) still to be read from a snapshot
+        self._interned = {}  # values shared between objects, see intern
+        self._versions = defaultdict(int)  # (branch, subbranch): bumped whenever objects are added or removed
         self.raise_error_on_duplicates = raise_error_on_duplicates
         self._relations = defaultdict(list)
+        self._subbranch_index = {}
+        self._idnumber_index = defaultdict(list)
         self.model_klass_list = model_klass_list or [[None] * len(subbranches)] * len(branches)
         self.importer_klass_list = importer_klass_list or [[None] * len(subbranches)] * len(branches)
         self._branch_class = branch_class if branch_class else Branch
@@ -72,7 +96,8 @@ class SyncTree(Tree):
             for i2, _ in enumerate(klasses):
                 sb = self.subbranches[i2]
                 klass_str = self.model_klass_list[i1][i2]
-                self._model_klasses[b][sb] = class_string_to_class(klass_str)
+                # Without a model class, one generated class is shared by the whole subbranch
+                self._model_klasses[b][sb] = class_string_to_class(klass_str) or initobj(b, sb)
                 klass_str = self.importer_klass_list[i1][i2]
                 self._importer_klasses[b][sb] = class_string_to_class(klass_str)
 
@@ -82,19 +107,30 @@ class SyncTree(Tree):
             model_klass_list = self.model_klass_list,
             importer_klass_list = self.importer_klass_list,
         )
+        self._rootdata = rootdata
 
         if jsonify_root_data:
             # This feature is used in order to re-create for later
-            rootdata = json.dumps(rootdata)
+            rootdata = json.dumps(rootdata, cls=JsonEncoder)
 
         # Make permanent root object, init clear-able branches and subbranches
         self.create_node(self.rootname, self.rootname, data=rootdata)
         self.init_branches_subbranches()
         #
 
+    def _clone(self, identifier=None, with_tree=False, deep=False):
+        """
+        treelib builds subtrees through this hook; they are plain views, not SyncTrees
+        """
+        return Tree(identifier=identifier, tree=self if with_tree else None, deep=deep)
+
     def init_branches_subbranches(self):
 
+        self._view = None
         for branch in self.branches:
+            self._records[branch] = {subbranch: {} for subbranch in self.subbranches}
+            for subbranch in self.subbranches:
+                self._subbranch_index[(branch, subbranch)] = set()
             branch_obj = self._branch_class(self, branch, self._subbranches, self._importer_klasses[branch])   # use _subbranches, not self.subbranches
             self.create_node(
                 branch, branch.lower(), parent=self.rootname, 
@@ -105,16 +141,150 @@ class SyncTree(Tree):
                     subbranch, self.path_delim.join([branch, subbranch]), parent=branch.lower(),
                 )
 
+    def intern(self, value):
+        """
+        Returns (value, hit): the copy of value shared by every object in the tree, made so on a miss
+        Only strings and tuples are shared, anything else is returned as is
+        """
+        if type(value) is str:
+            key = value
+        elif type(value) is tuple:
+            # (1,) == (1.0,), so the types of the members are part of the key too
+            key = (value, tuple(map(type, value)))
+        else:
+            return value, False
+        try:
+            shared = self._interned.get(key)
+        except TypeError:
+            return value, False
+        if shared is None:
+            self._interned[key] = value
+            return value, False
+        return shared, True
+
     def clear(self):
         """
         Remove branches, leaving root alone
         """
+        self._pending.clear()
+        self._interned.clear()
         for b in self.branches:
             branch = getattr(self, b)
             node_to_remove = f"{branch.branchname}"
             self.remove_subtree(node_to_remove)
         self.init_branches_subbranches()
 
+    def _unindex(self, nid):
+        """
+        Keep the idnumber indexes in step with nodes removed from the tree
+        """
+        pth = nid.split(self.path_delim)
+        for (branch, subbranch), idnumbers in self._subbranch_index.items():
+            if pth[0] != branch or (len(pth) > 1 and pth[1] != subbranch):
+                continue
+            removed = idnumbers & {pth[2]} if len(pth) == 3 else set(idnumbers)
+            if removed:
+                self._versions[(branch, subbranch)] += 1
+            for idnumber in removed:
+                idnumbers.discard(idnumber)
+                entries = [e for e in self._idnumber_index.pop(idnumber, []) if e[:2] != (branch, subbranch)]
+                if entries:
+                    self._idnumber_index[idnumber] = entries
+
+    def _unrecord(self, nid):
+        """
+        Drop objects held by the dict backend under nid
+        Returns True if nid was a leaf, which treelib knows nothing about
+        """
+        self._view = None
+        pth = nid.split(self.path_delim)
+        if len(pth) == 3:
+            self._records.get(pth[0], {}).get(pth[1], {}).pop(pth[2], None)
+            return True
+        for subbranch, records in self._records.get(pth[0], {}).items():
+            if len(pth) == 1 or pth[1] == subbranch:
+                records.clear()
+        return False
+
+    def remove_node(self, identifier):
+        self._load_pending()
+        self._unindex(identifier)
+        if self.backend == 'dict' and self._unrecord(identifier):
+            return 1
+        return super().remove_node(identifier)
+
+    def remove_subtree(self, nid, identifier=None):
+        self._load_pending()
+        self._unindex(nid)
+        if self.backend == 'dict' and self._unrecord(nid):
+            return Tree(identifier=identifier)
+        return super().remove_subtree(nid, identifier)
+
+    def treelib_view(self):
+        """
+        The tree as treelib sees it
+        With the dict backend, the leaves are grafted onto a fresh copy, cached until the next change
+        """
+        self._load_pending()
+        if self.backend != 'dict':
+            return self
+        if self._view is None:
+            view = Tree()
+            view.create_node(self.rootname, self.rootname, data=self.get_node(self.rootname).data)
+            for branch in self.branches:
+                view.create_node(branch, branch.lower(), parent=self.rootname)
+                for subbranch in self.subbranches:
+                    parent = self.keypath(branch, subbranch)
+                    view.create_node(subbranch, parent, parent=branch.lower())
+                    for idnumber, obj in self._records[branch][subbranch].items():
+                        view.create_node(idnumber, self.keypath(parent, idnumber), parent=parent, data=obj)
+            self._view = view
+        return self._view
+
+    def subtree(self, nid, identifier=None):
+        self._load_pending()
+        if self.backend == 'dict':
+            return self.treelib_view().subtree(nid, identifier)
+        return super().subtree(nid, identifier)
+
+    def to_dict(self, nid=None, key=None, sort=True, reverse=False, with_data=False):
+        self._load_pending()
+        if self.backend == 'dict':
+            return self.treelib_view().to_dict(nid=nid, key=key, sort=sort, reverse=reverse, with_data=with_data)
+        return super().to_dict(nid=nid, key=key, sort=sort, reverse=reverse, with_data=with_data)
+
+    def get(self, *pth: ['branch', 'subbranch', 'idnumber']):
+        """
+        The object stored at branch/subbranch/idnumber, or None
+        """
+        branch, subbranch, idnumber = pth
+        self._load_pending(branch, subbranch)
+        if self.backend == 'dict':
+            return self._records[branch][subbranch].get(idnumber)
+        node = self.get_node(self.keypath(*pth))
+        return node.data if node is not None else None
+
+    def idnumbers(self, branch, subbranch):
+        """
+        The live set of idnumbers held in branch/subbranch; callers must not mutate it
+        """
+        self._load_pending(branch, subbranch)
+        return self._subbranch_index[(branch, subbranch)]
+
+    def version(self, branch, subbranch):
+        """
+        Changes whenever an object of branch/subbranch is added or removed, or any object's attribute is set
+        """
+        self._load_pending(branch, subbranch)
+        return self._versions[(branch, subbranch)], Basebase._changes
+
+    def locate(self, idnumber):
+        """
+        Every (branch, subbranch, object) holding idnumber, in insertion order
+        """
+        self._load_pending()
+        return self._idnumber_index.get(idnumber, [])
+
     def keypath(self, *pth):
         """
         Converts raw information into the path
@@ -126,8 +296,9 @@ class SyncTree(Tree):
         Manually create a new object 
         """
         branch, subbranch, idnumber = pth
+        self._load_pending(branch, subbranch)
 
-        klass = self._model_klasses[branch][subbranch] or initobj(branch, subbranch, **kwargs)
+        klass = self._model_klasses[branch][subbranch]
         obj = klass(idnumber, **kwargs)
 
         # Augment the class name to hold branch and subbranch info
@@ -139,22 +310,60 @@ class SyncTree(Tree):
 
         # Capture the error as appropriate
         try:
-            result = self.create_node(idnumber, key, parent=parent, data=obj)
+            if self.backend == 'dict':
+                records = self._records[branch][subbranch]
+                if idnumber in records:
+                    raise treelib.tree.DuplicatedNodeIdError(f"Can't create node with ID '{key}'")
+                records[idnumber] = obj
+                self._view = None
+            else:
+                self.create_node(idnumber, key, parent=parent, data=obj)
         except treelib.tree.DuplicatedNodeIdError:
             if self.raise_error_on_duplicates:
                 raise  # TODO: use redefined exception
             else:
                 return None
-        # Augment this after creation so we can use it for tree operations
-        result = self.create_node(idnumber, key, parent=parent, data=obj)
-        # We have to get the result back
-        obj._node_identifier = result.identifier
+        self._subbranch_index[(branch, subbranch)].add(idnumber)
+        self._idnumber_index[idnumber].append((branch, subbranch, obj))
+        self._versions[(branch, subbranch)] += 1
+        obj._node_identifier = key
         
         return obj
 
-    def store(self, path):
-        with open(path, 'w') as _f:
-            json.dump(json.loads(self.to_json()), _f, indent=4)
+    def store(self, path, binary=False, branches=None, **info):
+        """
+        Writes the tree to path, for from_file to read back
+        As JSON, or with binary=True as a snapshot: the magic bytes and version,
+        followed by a stream of pickles: the root data, then for each subbranch
+        (branch, subbranch, count) and its objects in batches of (idnumber, kwargs),
+        then the table of where each subbranch starts, and that table's own offset
+        Snapshots can be limited to some branches, and carry info in their root data
+        """
+        if not binary:
+            with open(path, 'w') as _f:
+                json.dump(self.to_dict(with_data=True), _f, indent=4, cls=JsonEncoder)
+            return
+
+        rootdata = dict(self._rootdata, info=info)
+        for klass_list in ['model_klass_list', 'importer_klass_list']:
+            rootdata[klass_list] = [[class_to_string(k) for k in klasses] for klasses in rootdata[klass_list]]
+
+        self._load_pending()
+        offsets = {}
+        with open(path, 'wb') as _f:
+            _f.write(self.snapshot_magic + bytes([self.snapshot_version]))
+            pickle.dump(rootdata, _f, protocol=5)
+            for branch in branches or self.branches:
+                for subbranch in self.subbranches:
+                    offsets[(branch, subbranch)] = _f.tell()
+                    objs = [self.get(branch, subbranch, idnumber) for idnumber in self.idnumbers(branch, subbranch)]
+                    pickle.dump((branch, subbranch, len(objs)), _f, protocol=5)
+                    for start in range(0, len(objs), self.snapshot_batch):
+                        batch = [(obj.idnumber, obj._kwargs) for obj in objs[start:start + self.snapshot_batch]]
+                        pickle.dump(batch, _f, protocol=5)
+            table_offset = _f.tell()
+            pickle.dump(offsets, _f, protocol=5)
+            _f.write(struct.pack('>Q', table_offset))
 
     def show(self, *args, **kwargs):
         """
@@ -165,45 +374,49 @@ class SyncTree(Tree):
         tree.show()
         tree.show('subbranch', 'idnumber')
         """
+        view = self.treelib_view()
         if len(args) == 0:
-            super().show(**kwargs)
+            Tree.show(view, **kwargs)
         else:
             subbranch, idnumber, *_ = args
             kwargs['data_property'] = '_to_json'
             for branch in self.branches:
                 print(f"{branch}/{subbranch}/{idnumber}:")
                 path_to_node = f"{branch}{self.path_delim}{subbranch}{self.path_delim}{idnumber}"
-                super().show(path_to_node, **kwargs)
+                Tree.show(view, path_to_node, **kwargs)
                 for subbranch_to in self._relations[subbranch]:
                     path_to_node = f"{branch}{self.path_delim}{subbranch_to}{self.path_delim}{idnumber}"
                     try:
-                        super().show(path_to_node, **kwargs)
+                        Tree.show(view, path_to_node, **kwargs)
                     except treelib.tree.NodeIDAbsentError:
                         print(f"<no {subbranch_to}>")
 
     @classmethod
-    def from_file(cls, path):
+    def from_file(cls, path, lazy=False):
         """
         Reads in file (created by self.store or other)
         And adds
+        With lazy=True, a binary snapshot's subbranches are each read from path the first time
+        they are used (so the file must stay in place until then)
         """
-        
+        with open(path, 'rb') as _f:
+            if _f.read(len(cls.snapshot_magic)) == cls.snapshot_magic:
+                return cls._from_snapshot(path, _f, lazy)
+
         # Read in rootdata info, and create instance based on that
         with open(path, 'r') as _f:
             j = json.load(_f)
 
-        rootdata_string = j[cls.rootname]['data']
-        rootdata = json.loads(rootdata_string)
+        rootdata = j[cls.rootname]['data']
+        if isinstance(rootdata, str):
+            rootdata = json.loads(rootdata)
 
         # initiate with same values provided to them
-        t = SyncTree(rootdata['branches'], rootdata['subbranches'],
+        t = cls(rootdata['branches'], rootdata['subbranches'],
             model_klass_list=rootdata['model_klass_list'],
             importer_klass_list=rootdata['importer_klass_list']
         )
 
-        with open(path, 'r') as _f:
-            j = json.load(_f)
-
         root = j[cls.rootname]
         for branch_list in root['children']:
             for branch in branch_list.keys():
@@ -213,9 +426,110 @@ class SyncTree(Tree):
                             for idnumber in item.keys():
                                 data = item[idnumber]['data']
                                 kwargs = json.loads(data)
+                                kwargs.pop('idnumber', None)
                                 t.new(branch, subbranch, idnumber, **kwargs)
         return t
 
+    @classmethod
+    def _read_snapshot_header(cls, _f):
+        """
+        Returns the version and root data of the snapshot _f is in, just after its magic bytes
+        """
+        version = _f.read(1)[0]
+        if version not in (1, cls.snapshot_version):
+            raise ValueError(f"Snapshot version {version} cannot be read, expected {cls.snapshot_version}")
+        return version, pickle.load(_f)
+
+    @classmethod
+    def snapshot_rootdata(cls, path):
+        """
+        The root data of a snapshot, including any info it was stored with
+        """
+        with open(path, 'rb') as _f:
+            if _f.read(len(cls.snapshot_magic)) != cls.snapshot_magic:
+                raise ValueError(f"{path} is not a snapshot")
+            return cls._read_snapshot_header(_f)[1]
+
+    @classmethod
+    def _from_snapshot(cls, path, _f, lazy):
+        """
+        Reads the rest of a snapshot written by store(binary=True)
+        """
+        version, rootdata = cls._read_snapshot_header(_f)
+        t = cls(rootdata['branches'], rootdata['subbranches'],
+            model_klass_list=rootdata['model_klass_list'],
+            importer_klass_list=rootdata['importer_klass_list']
+        )
+        t._read_snapshot_body(path, _f, version, lazy)
+        return t
+
+    def load(self, path, branches=None, lazy=False, sections=None):
+        """
+        Adds the objects of a binary snapshot to this tree: those of all branches,
+        only some branches, or only some (branch, subbranch) sections
+        """
+        if branches is not None:
+            sections = {(branch, subbranch) for branch in branches for subbranch in self.subbranches}
+        with open(path, 'rb') as _f:
+            if _f.read(len(self.snapshot_magic)) != self.snapshot_magic:
+                raise ValueError(f"{path} is not a snapshot")
+            version, rootdata = self._read_snapshot_header(_f)
+            if rootdata['subbranches'] != self.subbranches:
+                raise ValueError("Snapshot has different subbranches")
+            self._read_snapshot_body(path, _f, version, lazy, sections)
+
+    def _read_snapshot_body(self, path, _f, version, lazy, sections=None):
+        """
+        Version 1 snapshots have no offset table, and are read in one pass
+        """
+        if version == 1:
+            while self._read_section(_f, sections):
+                pass
+            return
+
+        _f.seek(-8, os.SEEK_END)
+        _f.seek(struct.unpack('>Q', _f.read(8))[0])
+        for section, offset in pickle.load(_f).items():
+            if sections is None or section in sections:
+                self._pending[section] = (path, offset)
+        if not lazy:
+            self._load_pending()
+
+    def _read_section(self, _f, sections=None):
+        """
+        Makes the objects of the (branch, subbranch) section _f is at, if it is one of sections,
+        with their fingerprints stamped as after an import
+        Returns False at the end of the file
+        """
+        try:
+            branch, subbranch, count = pickle.load(_f)
+        except EOFError:
+            return False
+        while count > 0:
+            batch = pickle.load(_f)
+            if sections is None or (branch, subbranch) in sections:
+                for idnumber, kwargs in batch:
+                    obj = self.new(branch, subbranch, idnumber, **kwargs)
+                    if obj is not None:
+                        obj._stamp_fingerprint()
+            count -= len(batch)
+        return True
+
+    def _load_pending(self, *pth: ['branch', 'subbranch']):
+        """
+        Reads in subbranches of a lazily loaded snapshot, either the one given or all of them
+        """
+        if not self._pending:
+            return
+        for key in [tuple(pth)] if pth else list(self._pending):
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                continue
+            path, offset = pending
+            with open(path, 'rb') as _f:
+                _f.seek(offset)
+                self._read_section(_f)
+
     def register_relations(self, subbranches_from, subbranches_to):
         """
         Make it clear to the tree that idnumbers are shared between subbranches
@@ -279,8 +593,23 @@ class SyncTree(Tree):
             print("Cannot output difference since source is undetermined?")
 
     def __pos__(self):
-        for branch in self.branches:
-            +getattr(self, branch)
+        """
+        Imports every branch; all at once with import_workers, or when any reader is an async generator,
+        unless a branch class has its own __pos__, when each branch is imported by it in turn
+        """
+        brs = [getattr(self, branch) for branch in self.branches]
+        if any(type(br).__pos__ is not Branch.__pos__ for br in brs):
+            for br in brs:
+                +br
+            return
+        subbranches = [getattr(br, sb) for br in brs for sb in br.subbranches]
+        if self.import_workers:
+            import_concurrently(subbranches, self.import_workers)
+        elif any(subbranch.asynchronous for subbranch in subbranches):
+            import_asynchronously(subbranches)
+        else:
+            for br in brs:
+                +br
 
     def __str__(self):
         return "<{0.__class__.__name__}>".format(self)
@@ -3,23 +3,16 @@ from collections import namedtuple
 import json
 
 
-class initobj:
-    """
-    Light wrapper object that follows model object creation steps
-    Used so that we can use consistent API for naked objects    
-    """
-    def __init__(self, branch, subbranch, **kwargs):
-        self._klass_name = f'{branch.title()}{subbranch.title()}'
+class JsonEncoder(json.JSONEncoder):
 
     def default(self, obj):
-        if isinstance(obj, Branch):
-            return obj.to_json()
-        elif isinstance(obj, SubBranch):
-            return obj.to_json()
-        elif isinstance(obj, Base):
+        from synctree.base import Basebase
+        if isinstance(obj, Basebase):
             # All base objects become properties
             return obj._to_json
-        return super().encode(self, obj)
+        elif inspect.isclass(obj):
+            return class_to_string(obj)
+        return super().default(obj)
 
 
 class SetEncoder(json.JSONEncoder):
@@ -46,6 +39,15 @@ def extend_template_exceptions(more_exceptions: '', klass=None):
     return f"{klass._exceptions} {more_exceptions}"
 
 
+def class_to_string(klass):
+    """
+    Inverse of class_string_to_class, strings and None pass through
+    """
+    if not inspect.isclass(klass):
+        return klass
+    return f"{klass.__module__}.{klass.__qualname__}"
+
+
 def class_string_to_class(passed_string: 'module.submodule.ClassName'):
     """
     Get class object from string specification
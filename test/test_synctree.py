@@ -53,6 +53,10 @@ class MEnrollment(Enrollment):
     __slots__ = []
 
 
+class PlainStudent(Base):
+    pass
+
+
 class AStudentImp(DefaultImporter):
     def reader(self):
         yield dict(idnumber='99999', lastfirst="Shmoe, Joe")
@@ -86,6 +90,112 @@ def test_wrappedinit():
     assert tup.idnumber == '9999'
     assert tup.hi == 'hi'
 
+    # One class per factory, compact for the keys it first saw
+    other = tupfactory('8888', hi='there', extra='kept')
+    assert type(other) is type(tup)
+    assert 'hi' in type(tup).__slots__
+    assert not hasattr(tup, '__dict__') or tup.__dict__ == {}
+    assert other.extra == 'kept'
+
+    tree = SyncTree(['autosend', 'moodle'], ['students'])
+    tree.new('autosend', 'students', '1', hi='hi')
+    tree.new('autosend', 'students', '2', hi='there')
+    tree.new('moodle', 'students', '1', hi='hi')
+    klasses = {type(obj) for obj in tree.autosend.students}
+    assert len(klasses) == 1
+    assert klasses != {type(tree.moodle.students.get('1'))}
+
+    # Values are only held once, _kwargs is read back from the attributes
+    one, two = tree.autosend.students.get('1'), tree.autosend.students.get('2')
+    assert one._keys is two._keys
+    assert one._kwargs == {'hi': 'hi'}
+    one._update(hi='again', added=['x'])
+    assert one.hi == 'again'
+    assert json.loads(one._to_json) == {'hi': 'again', 'added': ['x'], 'idnumber': '1'}
+
+
+def test_diff_plan():
+    from synctree.base import diff_plan, _diff_plans
+    tree = SyncTree(['branch1', 'branch2'], ['subbranch1'])
+    left = tree.new('branch1', 'subbranch1', '000', change='this', same='same')
+    right = tree.new('branch2', 'subbranch1', '000', change='that', same='same')
+    assert [p[0] for p in diff_plan(left, right)] == ['change', 'idnumber', 'same']
+    assert len(_diff_plans) == len(set(_diff_plans))
+    plans = len(_diff_plans)
+    list(left - right)
+    assert len(_diff_plans) == plans  # reused
+
+    # Keys outside the generated slots are still compared
+    left = tree.new('branch1', 'subbranch1', '001', change='this', extra='new')
+    right = tree.new('branch2', 'subbranch1', '001', change='this', extra='old')
+    actions = list(left - right)
+    assert [(a.method, a.value, a.old_value) for a in actions] == [('update_subbranch1_extra', 'new', 'old')]
+
+
+def test_fingerprints():
+    tree = SyncTree(
+        ['autosend', 'moodle'],
+        ['students', 'staff', 'enrollments'],
+        ((AStudent, None, AEnrollment), (MStudent, None, MEnrollment)),
+        ((AStudentImp, None, AEnrollmentImp), (MStudentImp, None, MEnrollmentImp)),
+    )
+    +tree
+    # Properties are computed, so those objects are always diffed in full
+    assert tree.autosend.students.get('99999')._fingerprint is None
+    assert list(tree.autosend.students.get('99999') - tree.moodle.students.get('99999')) == []
+
+    autosend, moodle = tree.autosend.enrollments.get('99999'), tree.moodle.enrollments.get('99999')
+    assert isinstance(autosend._fingerprint, bytes)
+    assert [a.value for a in autosend - moodle] == ['9B']
+    assert list(tree.autosend.enrollments.unchanged(tree.moodle.enrollments)) == []
+    moodle._update(courses=['9B', '9A'])
+    assert moodle._fingerprint is None  # setting an attribute drops it
+    moodle._stamp_fingerprint()
+    assert list(tree.autosend.enrollments.unchanged(tree.moodle.enrollments)) == ['99999']
+
+    # Lists compare as sets, types must still match
+    from synctree.base import fingerprint
+    left = tree.new('autosend', 'enrollments', '1', courses=['9A', '9B'])
+    right = tree.new('moodle', 'enrollments', '1', courses=['9B', '9A', '9A'])
+    assert fingerprint(left) == fingerprint(right)
+    right.courses = {'9A', '9B'}
+    assert fingerprint(left) != fingerprint(right)
+    right.courses = [object()]
+    assert fingerprint(right) is None
+
+
+def test_fingerprints_follow_changes():
+    class SourceStudent(Base):
+        @property
+        def courses(self):
+            enrollments = self.__tree__.source.enrollments.get(self.idnumber)
+            return enrollments.courses if enrollments else []
+
+    class Students(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', grade='7')
+
+    class Enrollments(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', courses=['9A'])
+
+        def on_import_complete(self):
+            # Changes an object of a subbranch imported earlier
+            self._tree.source.students.get('1').grade = '8'
+
+    class DestinationStudents(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', grade='7', courses=[])
+
+    tree = SyncTree(
+        ['source', 'destination'], ['students', 'enrollments'],
+        [[SourceStudent, None], [None, None]],
+        [[Students, Enrollments], [DestinationStudents, None]],
+    )
+    SourceStudent.__tree__ = tree
+    +tree
+    actions = sorted(a.method for a in tree.source.students.diff(tree.destination.students))
+    assert actions == ['add_students_courses_to_destination', 'update_students_grade']
 
 def test_barebones():
     """ Test various init routines """
@@ -148,6 +258,162 @@ def test_init(inspect=False):
     assert tree.autosend.enrollments.get('11111').courses == {'10A', '10B'}  # test the set adding feature
 
 
+def test_concurrent_import():
+    import threading
+    import time
+    completed = []
+
+    class SlowImp(DefaultImporter):
+        def reader(self):
+            time.sleep(0.2)
+            for i in range(100):
+                yield dict(idnumber=str(i), name=f'{self._subbranch.subbranchname} {i}')
+
+        def on_import_complete(self):
+            # runs in the importing thread, once this subbranch and those before it are complete
+            assert threading.current_thread() is threading.main_thread()
+            completed.append((self._branch.branchname, self._subbranch.subbranchname, len(self._subbranch.idnumbers)))
+
+    class FailingImp(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1')
+            raise IOError("connection dropped")
+
+    tree = SyncTree(
+        ['autosend', 'moodle'], ['students', 'staff'],
+        importer_klass_list=[[SlowImp, SlowImp], [SlowImp, SlowImp]],
+        import_workers=4
+    )
+    start = time.time()
+    +tree
+    assert time.time() - start < 0.6  # not 4 x 0.2
+    assert completed == [(b, sb, 100) for b in ['autosend', 'moodle'] for sb in ['students', 'staff']]
+    assert tree.moodle.staff.get('99').name == 'staff 99'
+
+    tree = SyncTree(['autosend'], ['students', 'staff'], importer_klass_list=[[SlowImp, FailingImp]], import_workers=2)
+    with pytest.raises(IOError):
+        +tree
+
+    # A branch class with its own __pos__ still gets to import its branch
+    imported = []
+
+    class LoggingBranch(Branch):
+        def __pos__(self):
+            imported.append(self.branchname)
+            super().__pos__()
+
+    tree = SyncTree(['autosend', 'moodle'], ['students'], importer_klass_list=[[SlowImp], [SlowImp]],
+        import_workers=2, branch_class=LoggingBranch)
+    +tree
+    assert imported == ['autosend', 'moodle']
+    assert len(tree.moodle.students.idnumbers) == 100
+
+
+def test_async_import():
+    import asyncio
+    import time
+
+    class AsyncImp(DefaultImporter):
+        async def reader(self):
+            for i in range(250):
+                if i % 100 == 0:
+                    await asyncio.sleep(0.2)
+                yield dict(idnumber=str(i), name=f'{self._subbranch.subbranchname} {i}')
+
+    class SyncImp(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', name='sync')
+
+    class FailingImp(DefaultImporter):
+        async def reader(self):
+            yield dict(idnumber='1')
+            raise IOError("connection dropped")
+
+    tree = SyncTree(['autosend', 'moodle'], ['students', 'staff'], importer_klass_list=[[AsyncImp, AsyncImp], [AsyncImp, SyncImp]])
+    start = time.time()
+    +tree
+    assert time.time() - start < 1.2  # not 3 x 0.6
+    assert len(tree.autosend.staff.idnumbers) == 250
+    assert tree.moodle.students.get('249').name == 'students 249'
+    assert tree.moodle.staff.get('1').name == 'sync'
+
+    # One subbranch on its own, and in a thread with import_workers
+    tree = SyncTree(['autosend'], ['students'], importer_klass_list=[[AsyncImp]])
+    +tree.autosend.students
+    assert len(tree.autosend.students.idnumbers) == 250
+    tree = SyncTree(['autosend'], ['students'], importer_klass_list=[[AsyncImp]], import_workers=2)
+    +tree
+    assert len(tree.autosend.students.idnumbers) == 250
+
+    tree = SyncTree(['autosend'], ['students', 'staff'], importer_klass_list=[[AsyncImp, FailingImp]])
+    with pytest.raises(IOError):
+        +tree
+
+
+def test_streaming_aggregation():
+    made = []
+
+    class Enrollments(DefaultImporter):
+        def reader(self):
+            for idnumber in ['1', '2', '3']:
+                for course in ['9A', '9B', '9C']:
+                    yield dict(idnumber=idnumber, courses=[course], grade=course[0])
+
+        def resolve_duplicate(self, original_obj, **kwargs):
+            made.append(original_obj.idnumber)
+
+    class SortedEnrollments(Enrollments):
+        sorted_by_idnumber = True
+
+    from synctree.subbranch import SubBranch
+    sizes = []
+
+    class CountingSubBranch(SubBranch):
+        def make_accumulated(self):
+            sizes.append(len(self._temp))
+            super().make_accumulated()
+
+    class CountingBranch(Branch):
+        _subbranch_class = CountingSubBranch
+
+    for importer in [Enrollments, SortedEnrollments]:
+        sizes.clear()
+        tree = SyncTree(['autosend'], ['enrollments'], importer_klass_list=[[importer]], branch_class=CountingBranch)
+        +tree
+        assert made == []  # each object made once, never as a duplicate
+        assert tree.autosend.enrollments.get('2').courses == ['9A', '9B', '9C']
+        assert tree.autosend.enrollments.get('3').grade == '9'
+        assert max(sizes) == (1 if importer.sorted_by_idnumber else 3)
+
+
+def test_interning():
+    class Students(DefaultImporter):
+        intern_values = ['homeroom', 'courses']
+
+        def reader(self):
+            for idnumber in range(4):
+                # join makes a fresh string each time, as a reader would
+                yield dict(idnumber=str(idnumber), homeroom=''.join(['9', 'A']), grade=''.join(['1', '0']), courses=[''.join(['E', 'N'])])
+
+    tree = SyncTree(['autosend', 'moodle'], ['students'], importer_klass_list=[[Students], [Students]])
+    +tree
+    left, right = tree.autosend.students.get('0'), tree.moodle.students.get('3')
+    assert left.homeroom is right.homeroom
+    assert left.courses[0] is right.courses[0]
+    assert left.grade is not right.grade
+    assert tree.autosend.students.intern_stats['homeroom'] == {'hits': 3, 'misses': 1}
+    assert tree.moodle.students.intern_stats['courses'] == {'hits': 4}
+    assert 'grade' not in tree.moodle.students.intern_stats
+
+    assert tree.intern((1,)) == ((1,), False)
+    assert tree.intern((1.0,))[1] is False
+    assert tree.intern(1) == (1, False)
+    # The same object again is a hit, as it is already shared
+    value = ''.join(['a', 'b', 'c'])
+    assert tree.intern(value) == (value, False)
+    assert tree.intern(value) == (value, True)
+
+
 def test_narrowing():
     """
     Adding a feature which will only return a certain idnumber
@@ -186,6 +452,329 @@ def test_narrowing():
     # Test iteration on subbranches
     assert len(list(tree.branch1.subbranch1)) == 2
 
+def test_idnumber_index():
+    tree = SyncTree(['branch1', 'branch2'], ['subbranch1', 'subbranch2'])
+    tree.new('branch1', 'subbranch1', '000', change='this')
+    tree.new('branch1', 'subbranch1', '001', change='that')
+    tree.new('branch1', 'subbranch2', '002', change='other')
+
+    assert tree.branch1.subbranch1.idnumbers == {'000', '001'}
+    assert '000' in tree.branch1.subbranch1
+    assert '000' not in tree.branch2.subbranch1
+    assert tree.branch1.idnumbers == {'000', '001', '002'}
+
+    tree.remove_node('branch1/subbranch1/000')
+    assert tree.branch1.subbranch1.idnumbers == {'001'}
+
+    tree.clear()
+    assert tree.branch1.subbranch1.idnumbers == set()
+    tree.new('branch1', 'subbranch1', '000', change='this')
+    assert list(tree.branch1.subbranch1 - tree.branch2.subbranch1) == ['000']
+
+    # idnumbers is a copy, so the subbranch can be changed while going through it
+    tree.new('branch1', 'subbranch1', '001', change='that')
+    before = tree.branch1.subbranch1.idnumbers
+    for idnumber in tree.branch1.subbranch1.idnumbers:
+        tree.remove_node(tree.keypath('branch1', 'subbranch1', idnumber))
+    before.add('002')
+    assert before == {'000', '001', '002'}
+    assert tree.branch1.subbranch1.idnumbers == set()
+    assert '002' not in tree.branch1.subbranch1
+
+
+def test_idnumber_lookup(capsys):
+    tree = SyncTree(['branch1', 'branch2'], ['subbranch1', 'subbranch2'])
+    tree.new('branch1', 'subbranch1', '000', change='this')
+    tree.new('branch2', 'subbranch1', '000', change='that')
+    tree.new('branch1', 'subbranch2', '000', change='other')
+    tree.new('branch1', 'subbranch1', '001', change='nothing')
+
+    assert [o.change for o in tree.branch1('000')] == ['this', 'other']
+    assert [o.change for o in tree.branch2('000')] == ['that']
+    assert tree.branch2('001') == []
+
+    tree('000')
+    assert 'UPDATE_SUBBRANCH1_CHANGE: that ==> this' in capsys.readouterr().out
+
+    tree.remove_node('branch1/subbranch2/000')
+    assert [o.change for o in tree.branch1('000')] == ['this']
+    tree.clear()
+    assert tree.locate('000') == []
+
+
+def test_dict_backend(capsys):
+    branches = ['autosend', 'moodle']
+    subbranches = ['students', 'staff', 'enrollments']
+    tree = SyncTree(
+        branches,
+        subbranches,
+        ((AStudent, None, AEnrollment), (MStudent, None, MEnrollment)),
+        ((AStudentImp, None, AEnrollmentImp), (MStudentImp, None, MEnrollmentImp)),
+        raise_error_on_duplicates=False,
+        backend='dict'
+    )
+    +tree
+    assert tree.size() == 1 + len(branches) * (1 + len(subbranches))  # no leaves in treelib
+    assert tree.moodle.students.get('99999').lastfirst == 'Shmoe, Joe'
+    assert tree.get('autosend', 'enrollments', '11111').courses == {'10A', '10B'}
+    assert tree.new('moodle', 'students', '99999', first="Joe", last="Shmoe") is None
+
+    methods = sorted(a.method for a in tree.autosend - tree.moodle)
+    assert methods == ['add_enrollments_courses_to_moodle', 'new_enrollments', 'new_students', 'old_students']
+
+    assert tree.subtree('autosend/students').size() == 3
+    stored = json.loads(tree.to_json())
+    autosend = stored['root']['children'][0]['autosend']
+    students = [c['students'] for c in autosend['children'] if 'students' in c][0]
+    assert json.loads(students['children'][0]['11111']['data'])['lastfirst'] == 'Student, New'
+
+    tree.show()
+    tree.show('students', '99999')
+    assert '99999' in capsys.readouterr().out
+
+    tree.remove_node('moodle/students/zzzzz')
+    assert tree.moodle.students.get('zzzzz') is None
+    assert tree.subtree('moodle/students').size() == 2
+    tree.clear()
+    assert tree.autosend.students.idnumbers == set()
+    assert tree.subtree('autosend').size() == 1 + len(subbranches)
+
+    with pytest.raises(ValueError):
+        SyncTree(branches, subbranches, backend='nope')
+
+
+def test_columnar():
+    pytest.importorskip('numpy')
+    import random
+    random.seed(1)
+
+    def populate(tree):
+        for branch in tree.branches:
+            for i in range(200):
+                if random.random() < 0.1:
+                    continue
+                tree.new(branch, 'enrollments', str(i),
+                    grade=random.choice([6, 7]), courses=random.choice([['9A'], ['9A', '9B'], ['9B', '9A']]))
+
+    plain = SyncTree(['source', 'destination'], ['enrollments'])
+    columnar = SyncTree(['source', 'destination'], ['enrollments:columnar'])
+    state = random.getstate()
+    populate(plain)
+    random.setstate(state)
+    populate(columnar)
+
+    expected = sorted((a.idnumber, a.method, str(a.value)) for a in plain.source - plain.destination)
+    result = sorted((a.idnumber, a.method, str(a.value)) for a in columnar.source - columnar.destination)
+    assert expected
+    assert result == expected
+    assert len(columnar.source.enrollments.columns) == len(columnar.source.enrollments.idnumbers)
+
+    # Columns follow changes that keep the number of rows the same
+    def actions(tree):
+        return sorted((a.idnumber, a.method, str(a.value)) for a in tree.source - tree.destination)
+
+    for tree in (plain, columnar):
+        removed = sorted(tree.destination.enrollments.idnumbers)[0]
+        tree.remove_node(tree.keypath('destination', 'enrollments', removed))
+        tree.new('destination', 'enrollments', 'extra', grade=6, courses=['9A'])
+        tree.source.enrollments.get(removed)._update(grade=8)
+    assert ('extra', 'old_enrollments') in [action[:2] for action in actions(columnar)]
+    assert actions(columnar) == actions(plain)
+
+    # Computed attributes are read when diffed, not when the columns are built
+    class SourceStudent(Base):
+        @property
+        def courses(self):
+            enrollments = self.__tree__.source.enrollments.get(self.idnumber)
+            return enrollments.courses if enrollments else []
+
+    class Students(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', grade='7')
+
+    class Enrollments(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', courses=['9A'])
+
+    class DestinationStudents(DefaultImporter):
+        def reader(self):
+            yield dict(idnumber='1', grade='7', courses=[])
+
+    for students in ('students', 'students:columnar'):
+        tree = SyncTree(
+            ['source', 'destination'], [students, 'enrollments'],
+            [[SourceStudent, None], [None, None]],
+            [[Students, Enrollments], [DestinationStudents, None]],
+        )
+        SourceStudent.__tree__ = tree
+        +tree
+        assert sorted(a.method for a in tree.source - tree.destination) == [
+            'add_students_courses_to_destination', 'new_enrollments']
+
+
+def test_parallel_diff(monkeypatch):
+    import os
+    import pickle
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    tree = SyncTree(
+        ['autosend', 'moodle'],
+        ['students', 'staff', 'enrollments'],
+        ((AStudent, None, AEnrollment), (MStudent, None, MEnrollment)),
+        ((AStudentImp, None, AEnrollmentImp), (MStudentImp, None, MEnrollmentImp)),
+    )
+    +tree
+    for i in range(50):
+        tree.new('autosend', 'staff', str(i), name='Staff', grade=i % 3)
+        tree.new('moodle', 'staff', str(i), name='Staff', grade=i % 2)
+
+    def key(action):
+        return (action.idnumber, action.method, str(action.value), str(action.old_value))
+
+    expected = sorted(map(key, tree.autosend - tree.moodle))
+    ordered = list(tree.autosend.diff(tree.moodle, workers=2, shards=3))
+    assert sorted(map(key, ordered)) == expected
+    assert ordered == list(tree.autosend.diff(tree.moodle, workers=2, shards=3))
+    unordered = tree.autosend.diff(tree.moodle, workers=2, ordered=False)
+    assert sorted(map(key, unordered)) == expected
+
+    # Actions point at the objects in this tree, not at copies
+    update = [a for a in ordered if a.method == 'update_staff_grade'][0]
+    assert update.source is tree.autosend.staff.get(update.idnumber)
+
+    # Only stored values are sent, slots shadowed by properties included
+    student = tree.autosend.students.get('99999')
+    student._stamp_fingerprint()
+    copy = pickle.loads(pickle.dumps(student))
+    assert (copy.lastfirst, copy.last, copy.idnumber) == ('Shmoe, Joe', 'Shmoe', '99999')
+    assert getattr(copy, '_fingerprint', None) is None
+    staff = pickle.loads(pickle.dumps(tree.autosend.staff.get('1')))
+    assert staff._kwargs == {'name': 'Staff', 'grade': 1}
+
+
+@pytest.mark.parametrize('binary', [False, True])
+def test_store(tmp_path, binary):
+    tree = SyncTree(
+        ['autosend', 'moodle'],
+        ['students', 'staff', 'enrollments'],
+        ((AStudent, None, AEnrollment), (MStudent, None, MEnrollment)),
+        ((AStudentImp, None, AEnrollmentImp), (MStudentImp, None, MEnrollmentImp)),
+    )
+    +tree
+    tree.new('moodle', 'staff', '1', name='Staff', grades=[6, 7])
+    tree.snapshot_batch = 1
+    path = str(tmp_path / 'tree')
+    tree.store(path, binary=binary)
+    with open(path, 'rb') as _f:
+        assert _f.read(8).startswith(b'SYNCTREE') == binary
+
+    loaded = SyncTree.from_file(path)
+    assert loaded.branches == tree.branches
+    assert loaded.moodle.students.get('99999').lastfirst == 'Shmoe, Joe'
+    assert type(loaded.moodle.students.get('99999')) is MStudent
+    assert loaded.moodle.staff.get('1').grades == [6, 7]
+    assert sorted(loaded.autosend.enrollments.get('11111').courses) == ['10A', '10B']
+    assert loaded.autosend.students.idnumbers == tree.autosend.students.idnumbers
+    assert len(list(loaded.autosend - loaded.moodle)) == len(list(tree.autosend - tree.moodle))
+
+
+def test_lazy_load(tmp_path):
+    tree = SyncTree(['source', 'destination'], ['students', 'enrollments'])
+    for branch in tree.branches:
+        for i in range(5):
+            tree.new(branch, 'students', str(i), name=f'{branch} {i}')
+            tree.new(branch, 'enrollments', str(i), courses=[branch])
+    path = str(tmp_path / 'tree')
+    tree.store(path, binary=True)
+
+    loaded = SyncTree.from_file(path, lazy=True)
+    assert len(loaded._pending) == 4
+    assert loaded.destination.enrollments.get('3').courses == ['destination']
+    assert list(loaded._pending) == [('source', 'students'), ('source', 'enrollments'), ('destination', 'students')]
+    assert len(list(loaded.source.students)) == 5
+    assert len(loaded._pending) == 2
+    assert len(list(loaded.source.enrollments - loaded.destination.enrollments)) == 0
+    assert list(loaded._pending) == [('destination', 'students')]
+    assert len(loaded.destination('4')) == 2
+    assert loaded._pending == {}
+
+
+def test_delta_sync(tmp_path):
+    import os
+    from synctree.delta import DeltaSync
+    from synctree.templates import DefaultTemplate
+    from synctree.results import successful_result, unsuccessful_result
+
+    source_rows = {'1': dict(name='One', courses=['9A']), '2': dict(name='Two', courses=['9B'])}
+    destination_rows = {'2': dict(name='Too', courses=['9B', '9C']), '3': dict(name='Three', courses=[])}
+    reads = []
+
+    class SourceImp(DefaultImporter):
+        def reader(self):
+            for idnumber, row in source_rows.items():
+                yield dict(row, idnumber=idnumber)
+
+    class DestinationImp(DefaultImporter):
+        def reader(self):
+            reads.append(1)
+            for idnumber, row in destination_rows.items():
+                yield dict(row, idnumber=idnumber)
+
+    class Template(DefaultTemplate):
+        def new_students(self, action):
+            return successful_result(method=action.method)
+
+        def old_students(self, action):
+            return successful_result(method=action.method)
+
+        def update_students_name(self, action):
+            return successful_result(method=action.method)
+
+        def add_students_courses_to_destination(self, action):
+            return successful_result(method=action.method)
+
+        def remove_students_courses_from_destination(self, action):
+            return unsuccessful_result(method=action.method)  # remains to be done
+
+    path = str(tmp_path / 'destination')
+    stamped = []
+
+    def run(model=None):
+        tree = SyncTree(['source', 'destination'], ['students'], [[None], [model]], importer_klass_list=[[SourceImp], [DestinationImp]])
+        delta = DeltaSync(tree, path, full_every=2)
+        full = delta.import_branches()
+        stamped.append(all(getattr(o, '_fingerprint', None) is not None for o in tree.destination.students))
+        actions = sorted((a.method, a.idnumber) for a in tree.source - tree.destination)
+        (tree.source > tree.destination) | delta.track(Template())
+        delta.store()
+        return full, actions
+
+    full, actions = run()
+    assert full and len(reads) == 1
+    assert actions == [
+        ('new_students', '1'), ('old_students', '3'),
+        ('remove_students_courses_from_destination', '2'), ('update_students_name', '2'),
+    ]
+
+    source_rows['1'] = dict(name='One', courses=['9A', '9D'])
+    full, actions = run()
+    assert not full and len(reads) == 1  # destination not imported
+    assert stamped == [True, True]  # loaded objects keep the fingerprint shortcut
+    assert actions == [('add_students_courses_to_destination', '1'), ('remove_students_courses_from_destination', '2')]
+
+    full, actions = run()
+    assert full and len(reads) == 2  # third run re-imports the destination
+    assert actions == [
+        ('new_students', '1'), ('old_students', '3'),
+        ('remove_students_courses_from_destination', '2'), ('update_students_name', '2'),
+    ]
+
+    # Objects made for new_ actions get the source's values, models without __slots__ included
+    os.remove(path)
+    full, actions = run(PlainStudent)
+    assert full and ('new_students', '1') in actions
+    assert not any(action.startswith('err_') for action, _ in run(PlainStudent)[1])
+
+
 def test_importers():
     from synctree.importers.csv_importer import CSVImporter
 
@@ -223,6 +812,289 @@ def test_importers():
     print(synctree.show())
     print(synctree.show('students', '111'))
 
+def test_import_cache(tmp_path):
+    from synctree.importers.csv_importer import CSVImporter
+    from synctree.cache import ImportCache
+    import os
+
+    for name, content in [('students', '111,NoName,7\n'), ('staff', '222,Teacher\n')]:
+        with open(tmp_path / f'{name}.csv', 'w') as file_:
+            file_.write(content)
+
+    class StudentImporter(CSVImporter):
+        _settings = {'path': str(tmp_path / 'students.csv'), 'students_columns': 'idnumber name grade', 'delimiter': ','}
+
+    completed = []
+
+    class StaffImporter(CSVImporter):
+        _settings = {'path': str(tmp_path / 'staff.csv'), 'staff_columns': 'idnumber name', 'delimiter': ','}
+
+        def on_import_complete(self):
+            staff = self._tree.source.staff.get('222')
+            completed.append(staff.name)
+            staff._update(roles=getattr(staff, 'roles', []) + ['teacher'])
+
+    def cached_import():
+        tree = SyncTree(['source'], ['students', 'staff'], importer_klass_list=[[StudentImporter, StaffImporter]])
+        reused = ImportCache(tree, str(tmp_path / 'cache')).import_tree()
+        return tree, reused
+
+    tree, reused = cached_import()
+    assert reused == set()
+    tree, reused = cached_import()
+    assert reused == {('source', 'students'), ('source', 'staff')}
+    assert tree.source.students.get('111').grade == '7'
+    assert tree.source.students.get('111')._fingerprint is not None
+    assert completed == ['Teacher', 'Teacher']  # hook runs for the cached staff as well
+    assert tree.source.staff.get('222').roles == ['teacher']  # on objects as imported, not as the hook left them
+
+    with open(tmp_path / 'students.csv', 'w') as file_:
+        file_.write('111,NoName,8\n')
+    os.utime(tmp_path / 'students.csv', ns=(0, 0))
+    tree, reused = cached_import()
+    assert reused == {('source', 'staff')}
+    assert tree.source.students.get('111').grade == '8'
+    assert tree.source.staff.get('222').name == 'Teacher'
+
+
+def test_csv_sidecar(tmp_path, monkeypatch):
+    from synctree.importers.csv_importer import CSVImporter
+    import csv
+    import os
+
+    path = tmp_path / 'students.csv'
+    with open(path, 'w') as file_:
+        file_.write('111,NoName,7\n222,"Some, Name",8\n')
+
+    class StudentImporter(CSVImporter):
+        _settings = {'path': str(path), 'students_columns': 'idnumber name grade', 'delimiter': ',', 'sidecar': True}
+
+    def imported():
+        tree = SyncTree(['source'], ['students'], importer_klass_list=[[StudentImporter]])
+        +tree
+        return {o.idnumber: (o.name, o.grade) for o in tree.source.students}
+
+    expected = {'111': ('NoName', '7'), '222': ('Some, Name', '8')}
+    assert imported() == expected
+    assert os.path.exists(str(path) + '.parsed')
+
+    def unparseable(*args, **kwargs):
+        raise AssertionError("should not be parsed")
+
+    # Serial and parallel parsing both go through csv.reader
+    with monkeypatch.context() as patched:
+        patched.setattr(csv, 'reader', unparseable)
+        assert imported() == expected
+        os.rename(str(path) + '.parsed', str(path) + '.moved')
+        with pytest.raises(AssertionError, match="should not be parsed"):
+            imported()
+    os.rename(str(path) + '.moved', str(path) + '.parsed')
+
+    with open(path, 'w') as file_:
+        file_.write('111,NoName,8\n')
+    os.utime(path, ns=(0, 0))
+    assert imported() == {'111': ('NoName', '8')}
+
+
+def test_csv_projection(tmp_path):
+    from synctree.importers.csv_importer import CSVImporter
+    import csv
+    import io
+
+    text = 'idnumber,name,grade,homeroom\n111,"Some, Name",7,7A\n222,Short\n\n333,Long,8,8B,extra\n'
+    importer = CSVImporter.__new__(CSVImporter)
+    importer._settings = {'delimiter': ','}
+    assert list(importer.parse(io.StringIO(text))) == list(csv.DictReader(io.StringIO(text)))
+    assert list(importer.parse(io.StringIO(text), projection={'idnumber', 'grade'})) == [
+        {'idnumber': '111', 'grade': '7'}, {'idnumber': '222', 'grade': None}, {'idnumber': '333', 'grade': '8'}]
+
+    path = tmp_path / 'students.csv'
+    path.write_text(text)
+
+    class Pupil(Base):
+        __slots__ = ['name']
+
+    class StudentImporter(CSVImporter):
+        _settings = {'path': str(path), 'delimiter': ',', 'projection': '__slots__'}
+
+    tree = SyncTree(['source'], ['students'], [[Pupil]], importer_klass_list=[[StudentImporter]])
+    +tree
+    assert tree.source.students.get('111').name == 'Some, Name'
+    assert not hasattr(tree.source.students.get('111'), 'grade')
+
+    StudentImporter._settings['projection'] = 'idnumber grade'
+    tree = SyncTree(['source'], ['students'], importer_klass_list=[[StudentImporter]])
+    +tree
+    assert tree.source.students.get('333')._kwargs == {'grade': '8'}
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_csv_parallel(tmp_path, ordered):
+    from synctree.importers.csv_importer import CSVImporter, record_boundaries
+    import csv
+
+    path = tmp_path / 'enrollments.csv'
+    with open(path, 'w', newline='') as file_:
+        writer = csv.writer(file_)
+        writer.writerow(['idnumber', 'note', 'course'])
+        for i in range(2000):
+            # Quoted fields with newlines, quotes and delimiters inside them
+            writer.writerow([str(i), 'line one\nline "two", {}\n'.format(i) if i % 3 else '', 'C{}'.format(i % 7)])
+
+    boundaries = record_boundaries(path, 1000)
+    assert boundaries[0] == 0 and boundaries[-1] == path.stat().st_size and len(boundaries) > 10
+    with open(path, 'rb') as file_:
+        data = file_.read()
+    for a, b in zip(boundaries, boundaries[1:]):
+        assert len(list(csv.reader(data[a:b].decode().splitlines(keepends=True)))) > 0
+    assert record_boundaries(path, 1000, header=True)[1] == len('idnumber,note,course\r\n')
+
+    class EnrollmentImporter(CSVImporter):
+        _settings = {'path': str(path), 'delimiter': ',', 'parallel': 2, 'chunk_size': 4096, 'ordered': ordered}
+
+    importer = EnrollmentImporter.__new__(EnrollmentImporter)
+    importer._settings = EnrollmentImporter._settings
+    assert importer.parallel_workers(str(path)) == 2
+    with open(path, newline='') as file_:
+        expected = list(csv.DictReader(file_))
+    parsed = list(importer.parse_in_parallel(str(path), None, None, 2))
+    if ordered:
+        assert parsed == expected
+    else:
+        assert sorted(parsed, key=lambda r: int(r['idnumber'])) == expected
+
+    tree = SyncTree(['source'], ['enrollments'], importer_klass_list=[[EnrollmentImporter]])
+    +tree
+    assert tree.source.enrollments.get('5').note == 'line one\nline "two", 5\n'
+    assert len(tree.source.enrollments.idnumbers) == 2000
+
+    importer._settings = dict(EnrollmentImporter._settings, chunk_size=10 ** 9)
+    assert importer.parallel_workers(str(path)) is None
+
+
+@pytest.mark.parametrize('extension', ['.csv.gz', '.csv.zst', '.export'])
+def test_compressed_csv(tmp_path, extension):
+    from synctree.importers.csv_importer import CSVImporter
+    from synctree.importers.compressed import compression
+    import gzip
+
+    text = 'idnumber,name\n111,"Multi\nLine"\n222,Other\n'
+    path = tmp_path / ('students' + extension)
+    if extension.endswith('.zst'):
+        zstandard = pytest.importorskip('zstandard')
+        path.write_bytes(zstandard.ZstdCompressor().compress(text.encode()))
+    else:
+        # the magic bytes are enough without the extension
+        path.write_bytes(gzip.compress(text.encode()))
+    assert compression(path) == ('zstd' if extension.endswith('.zst') else 'gzip')
+
+    class StudentImporter(CSVImporter):
+        _settings = {'path': str(path), 'delimiter': ',', 'buffer_size': '65536', 'parallel': True, 'chunk_size': 1}
+
+    tree = SyncTree(['source'], ['students'], importer_klass_list=[[StudentImporter]])
+    +tree
+    assert tree.source.students.get('111').name == 'Multi\nLine'
+    assert tree.source.students.get('222').name == 'Other'
+
+
+@pytest.mark.parametrize('name', ['students.jsonl', 'students.jsonl.gz'])
+def test_jsonlines(tmp_path, name):
+    from synctree.importers import JSONLinesImporter, export_jsonlines
+
+    path = tmp_path / 'source.jsonl'
+    path.write_text('{"student_number": 111, "name": "Some Name", "grade": 7, "courses": ["9A"]}\n\n'
+                    '{"student_number": 222, "name": "Other", "grade": 8, "courses": ["9B"]}\n')
+
+    class StudentImporter(JSONLinesImporter):
+        _settings = {'path': str(path), 'idnumber_field': 'student_number', 'projection': 'name courses'}
+
+    tree = SyncTree(['source', 'copy'], ['students'], importer_klass_list=[[StudentImporter], [JSONLinesImporter]])
+    +tree.source
+    assert tree.source.students.get('111')._kwargs == {'name': 'Some Name', 'courses': ['9A']}
+
+    exported = tmp_path / name
+    assert export_jsonlines(tree.source.students, exported) == 2
+    JSONLinesImporter._settings = {'path': str(exported)}
+    try:
+        +tree.copy
+    finally:
+        JSONLinesImporter._settings = {}
+    assert list(tree.source - tree.copy) == []
+    tree.copy.students.get('111').name = 'Changed'
+    assert [a.method for a in tree.source - tree.copy] == ['update_students_name']
+    assert tree.copy.students.get('222').courses == ['9B']
+
+
+def test_translated_csv(tmp_path):
+    from synctree.importers.csv_importer import CSVImporter, TranslatedCSVImporter
+
+    for campus, rows in [('elementary', '1,E1\n2,E2\n'), ('secondary', '1,S1\n3,S3\n')]:
+        (tmp_path / campus).mkdir()
+        (tmp_path / campus / 'enrollments.csv').write_text(rows)
+
+    class CampusImporter(CSVImporter):
+        _settings = {'path': str(tmp_path / 'campus' / 'enrollments.csv'), 'enrollments_columns': 'idnumber course', 'delimiter': ','}
+
+        def kwargs_preprocessor(self, kwargs_in):
+            return dict(idnumber=kwargs_in['idnumber'], courses=[kwargs_in['course']])
+
+    class EnrollmentImporter(TranslatedCSVImporter):
+        klass = CampusImporter
+        translate = {'campus': ['elementary', 'secondary']}
+
+    for _ in range(2):
+        tree = SyncTree(['source'], ['enrollments'], importer_klass_list=[[EnrollmentImporter]])
+        +tree
+        assert len(tree.source.enrollments.importer.csv_importers) == 2
+        assert tree.source.enrollments.get('1').courses == ['E1', 'S1']
+        assert tree.source.enrollments.get('3').courses == ['S3']
+
+    EnrollmentImporter.ordered = False
+    tree = SyncTree(['source'], ['enrollments'], importer_klass_list=[[EnrollmentImporter]])
+    +tree
+    assert sorted(tree.source.enrollments.get('1').courses) == ['E1', 'S1']
+
+
+def test_db_reader(tmp_path):
+    sqlalchemy = pytest.importorskip('sqlalchemy')
+    from synctree.importers.db_importer import DBImporter
+
+    engine_string = 'sqlite:///{}'.format(tmp_path / 'school.db')
+    with sqlalchemy.create_engine(engine_string).begin() as connection:
+        connection.execute(sqlalchemy.text('CREATE TABLE enrollments (student_number TEXT, course TEXT)'))
+        connection.execute(sqlalchemy.text('INSERT INTO enrollments VALUES (:s, :c)'),
+            [dict(s=str(i // 2), c='C{}'.format(i)) for i in range(10)])
+
+    class EnrollmentImporter(DBImporter):
+        _settings = {'batch_size': 3}
+        sql = 'SELECT student_number, course FROM enrollments ORDER BY student_number'
+        column_names = {'student_number': 'idnumber'}
+
+        @property
+        def engine_string(self):
+            return engine_string
+
+        def row_to_kwargs(self, row):
+            kwargs = super().row_to_kwargs(row)
+            kwargs['courses'] = [kwargs.pop('course')]
+            return kwargs
+
+    tree = SyncTree(['source'], ['enrollments'], importer_klass_list=[[EnrollmentImporter]])
+    +tree
+    assert tree.source.enrollments.get('4').courses == ['C8', 'C9']
+    assert len(tree.source.enrollments.idnumbers) == 5
+
+    # Importers of the same database share one engine
+    from synctree.importers.db_importer import dispose_engines
+    class PooledImporter(EnrollmentImporter):
+        _settings = {'batch_size': 3, 'pool_size': '2', 'pool_pre_ping': 'false'}
+    assert PooledImporter(tree, None, None).engine_options() == {'pool_size': 2, 'pool_pre_ping': False}
+    assert PooledImporter(tree, None, None).engine is tree.source.enrollments.importer.engine
+    dispose_engines()
+    assert PooledImporter(tree, None, None).engine is not tree.source.enrollments.importer.engine
+    dispose_engines()
+
+
 def test_templates():
 
     from synctree.templates import DefaultTemplate, LoggerReporter